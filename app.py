@@ -1,13 +1,39 @@
-from flask import Flask, request, jsonify, send_file, render_template
+import time
+BOOT_STARTED = time.time()  # the startup report measures from here
+
+from flask import Flask, request, jsonify, send_file, render_template, Response, stream_with_context
 from flask_cors import CORS
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+from werkzeug.exceptions import HTTPException
 import os
 import uuid
-import time
+import signal
 import threading
 import logging
-from utils.downloader import download_reel_with_cookies, download_public_reel
+import json
+import requests
+from urllib.parse import quote
+from utils.downloader import download_reel_with_cookies, download_public_reel, extract_reel_info
+from utils.jobs import JobManager, JobJournal, QueueFullError, JOB_QUEUED, JOB_FINISHED, JOB_FAILED, current_job_id
+from utils.cache import ResultCache, InfoCache, NegativeCache, PERMANENT_REASONS
+from utils.urls import is_supported_url, media_key, metric_platform, short_links
+from utils.singleflight import SingleFlight, FlightTimeoutError
+from utils.streaming import open_upstream, relay_headers, iter_upstream
+from utils.strategies import strategy_stats, strategy_breakers, warm_ydl_pool
+from utils.ydl_pool import ydl_pool
+from utils.cookie_pool import get_cookie_pool
+from utils.proxies import proxy_pool
+from utils.file_registry import FileRegistry
+from utils.storage import storage_manager
+from utils.throttle import upstream_throttle
+from utils.transcode import PRESETS, transcode, transcode_available, variant_key
+from utils.state import state_backend_from_env
+from utils.host_lock import HostLock
+from utils.batch import dedupe_urls, run_batch, iter_zip, batch_summary, manifest_json
+from utils.metrics import (
+    registry, gauge, timed, STAGE_SECONDS, DOWNLOADS, CACHE_REQUESTS, BYTES_SERVED, CLEANUP_DELETED
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -16,41 +42,282 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 CORS(app)
 
+# State shared between workers and instances (STATE_BACKEND_URL); None keeps it in-process
+state_backend = state_backend_from_env()
+
 # Rate limiting
 limiter = Limiter(
     get_remote_address,
     app=app,
     default_limits=["500 per day", "50 per hour"],
-    storage_uri="memory://",
+    storage_uri=state_backend.limiter_uri if state_backend else "memory://",
 )
 
 # Configuration
 DOWNLOAD_FOLDER = 'downloads'
 COOKIES_FOLDER = 'cookies'
 MAX_FILE_AGE = 1800  # 30 minutes
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 4))
+JOB_QUEUE_SIZE = int(os.environ.get('JOB_QUEUE_SIZE', 16))
+JOB_RETRY_AFTER = 10  # seconds
+CACHE_TTL = int(os.environ.get('CACHE_TTL', MAX_FILE_AGE))
+CACHE_MAX_BYTES = int(os.environ.get('CACHE_MAX_BYTES', 1024 * 1024 * 1024))  # 1 GB
+FLIGHT_TIMEOUT = 300  # seconds a request waits on another request's download
+INFO_CACHE_TTL = int(os.environ.get('INFO_CACHE_TTL', 600))
+NEGATIVE_CACHE_TTL = int(os.environ.get('NEGATIVE_CACHE_TTL', 900))  # removed/private/age-restricted reels
+INFO_TIMEOUT = 60  # seconds a request waits on another request's info lookup
+BATCH_MAX_URLS = int(os.environ.get('BATCH_MAX_URLS', 200))
+PROGRESS_EVENT_INTERVAL = 0.25  # seconds; progress events are coalesced to at most 4 a second
+SSE_KEEPALIVE = 15  # seconds between comments on an idle event stream
+# Seconds a WSGI event stream stays open; it holds a worker thread, so it ends
+# early and the browser reconnects. The ASGI front end has no such limit.
+SSE_STREAM_LIFETIME = int(os.environ.get('SSE_STREAM_LIFETIME', 20))
+FILE_JOURNAL = os.environ.get('FILE_JOURNAL')  # journal of produced files, replayed on restart
+JOB_JOURNAL = os.environ.get('JOB_JOURNAL')  # SQLite journal of jobs; interrupted jobs resume on restart
+SHUTDOWN_GRACE = int(os.environ.get('SHUTDOWN_GRACE', 25))  # seconds running jobs get to finish on shutdown
+SCHEDULER_LOCK = os.environ.get('SCHEDULER_LOCK', os.path.join('data', 'scheduler.lock'))
+# Set by gunicorn.conf.py: the app is imported once in the master and every
+# forked worker starts its own background threads (threads don't survive a fork)
+DEFER_BACKGROUND_TASKS = os.environ.get('DEFER_BACKGROUND_TASKS') == '1'
 
 if not os.path.exists(DOWNLOAD_FOLDER):
     os.makedirs(DOWNLOAD_FOLDER)
 if not os.path.exists(COOKIES_FOLDER):
     os.makedirs(COOKIES_FOLDER)
 
+job_manager = JobManager(
+    max_workers=JOB_WORKERS, max_queued=JOB_QUEUE_SIZE, state=state_backend,
+    journal=JobJournal(JOB_JOURNAL) if JOB_JOURNAL else None,
+)
+# Jobs the last shutdown interrupted; they are resumed once the app is set up
+interrupted_jobs = job_manager.load(MAX_FILE_AGE)
+file_registry = FileRegistry(
+    DOWNLOAD_FOLDER, default_ttl=MAX_FILE_AGE, journal_path=FILE_JOURNAL, state=state_backend
+)
+cookie_registry = FileRegistry(COOKIES_FOLDER, default_ttl=MAX_FILE_AGE)
+# Files left by a previous run without a journal entry expire by their age;
+# partial downloads are deleted unless an interrupted job will continue them
+file_registry.adopt(MAX_FILE_AGE, keep_partial=lambda name: any(job_id in name for job_id in interrupted_jobs))
+cookie_registry.adopt(MAX_FILE_AGE)
+result_cache = ResultCache(
+    DOWNLOAD_FOLDER, ttl=CACHE_TTL, max_bytes=CACHE_MAX_BYTES, registry=file_registry, state=state_backend
+)
+storage_manager.track(file_registry)
+download_flights = SingleFlight(stale_after=FLIGHT_TIMEOUT)
+info_cache = InfoCache(ttl=INFO_CACHE_TTL)
+negative_cache = NegativeCache(ttl=NEGATIVE_CACHE_TTL, state=state_backend)
+info_flights = SingleFlight(stale_after=INFO_TIMEOUT)
+cookie_pool = get_cookie_pool(COOKIES_FOLDER)
+
+gauge('reels_jobs', 'Download jobs by state', ('state',), callback=lambda: [
+    ({"state": state}, count) for state, count in job_manager.stats().items()
+    if state not in ('max_workers', 'max_queued')
+])
+gauge('reels_cache_bytes', 'Bytes of cached reels on disk', callback=lambda: [({}, result_cache.stats()['bytes'])])
+gauge('reels_downloads_in_flight', 'Distinct reels being downloaded', callback=lambda: [({}, download_flights.in_flight())])
+
 @app.route('/')
 def home():
     return render_template('index.html')
 
-@app.route('/api/status')
-def status():
-    return jsonify({
+def status_payload():
+    """Body of /api/status, shared with the ASGI front end"""
+    return {
         "status": "active", 
         "message": "Reels Downloader - Fixed Version",
+        "jobs": job_manager.stats(),
+        "cache": result_cache.stats(),
+        "files": file_registry.stats(),
+        "storage": storage_manager.stats(),
+        "info_cache": info_cache.stats(),
+        "negative_cache": negative_cache.stats(),
+        "short_links": short_links.stats(),
+        "strategies": strategy_stats.snapshot(),
+        "breakers": strategy_breakers.snapshot(),
+        "cookies": cookie_pool.health(),
+        "proxies": proxy_pool.health(),
+        "ydl_pool": ydl_pool.stats(),
+        "upstream": upstream_throttle.stats(),
+        "state_backend": type(state_backend).__name__ if state_backend else None,
+        "startup": dict(startup, scheduler=scheduler_lock.held()),
         "timestamp": time.time()
-    })
+    }
+
+@app.route('/api/status')
+def status():
+    return jsonify(status_payload())
+
+def fetch_reel(reel_url, cache_key, use_cookies=True, progress_callback=None):
+    """Download a reel, register its file and hand it to the result cache"""
+    # Try download with cookies first, then fallback to public
+    if use_cookies:
+        result = download_reel_with_cookies(reel_url, DOWNLOAD_FOLDER, COOKIES_FOLDER, progress_callback)
+    else:
+        result = download_public_reel(reel_url, DOWNLOAD_FOLDER, progress_callback)
+    
+    if result['success']:
+        file_registry.register(result['filename'], owner=current_job_id(), size=result.get('file_size'))
+        if cache_key:
+            result_cache.put(cache_key, result)
+    # Without cookies, login_required says nothing about a request that has them
+    elif cache_key and (use_cookies or result.get('reason') != 'login_required') and negative_cache.put(cache_key, result):
+        logger.info(f"Remembering {result['reason']} for {cache_key}")
+    
+    return result
+
+def fetch_variant(source, cache_key, preset):
+    """Transcode a downloaded reel to a preset, register the output and cache it under cache_key"""
+    result = transcode(source, preset, DOWNLOAD_FOLDER)
+    
+    if result['success']:
+        file_registry.register(result['filename'], owner=current_job_id(), size=result['file_size'])
+        if cache_key:
+            result_cache.put(cache_key, result)
+    
+    return result
+
+def get_variant(source, cache_key, preset):
+    """A preset's variant of a downloaded reel; concurrent requests share one transcode"""
+    if not cache_key:
+        return fetch_variant(source, None, preset)
+    
+    key = variant_key(cache_key, preset)
+    try:
+        result, _ = download_flights.do(key, fetch_variant, source, key, preset, timeout=FLIGHT_TIMEOUT)
+        return dict(result)
+    except FlightTimeoutError:
+        return {
+            "success": False,
+            "error": "Timed out waiting for transcoding",
+            "solution": "Try again in a moment"
+        }
+
+def run_download(reel_url, use_cookies=True, preset=None, progress_callback=None):
+    """Download a reel, transcode it if a preset is given, and build the API result (runs on a job worker)"""
+    start_time = time.time()
+    
+    platform = metric_platform(reel_url)
+    # Share and fb.watch links are keyed by the reel they lead to
+    cache_key = media_key(reel_url)
+    result = None
+    shared = False
+    known_failure = None
+    
+    # A cached variant doesn't need its source any more
+    if preset and cache_key:
+        result = result_cache.get(variant_key(cache_key, preset))
+        CACHE_REQUESTS.inc(cache='variant', result='hit' if result else 'miss')
+    variant_cached = result is not None
+    
+    if cache_key and not variant_cached:
+        result = result_cache.get(cache_key)
+        CACHE_REQUESTS.inc(cache='result', result='hit' if result else 'miss')
+    cached = result is not None
+    
+    if cache_key and not cached:
+        known_failure = negative_cache.get(cache_key)
+        CACHE_REQUESTS.inc(cache='negative', result='hit' if known_failure else 'miss')
+    
+    if cached:
+        logger.info(f"Cache hit: {cache_key}")
+        result['success'] = True
+    elif known_failure:
+        logger.info(f"Known failure for {cache_key}: {known_failure['reason']}")
+        result = dict(known_failure, success=False)
+    elif cache_key:
+        # Concurrent requests for the same reel (and cookie choice) wait on a
+        # single download and see its progress
+        try:
+            result, shared = download_flights.do_with_progress(
+                f"{cache_key}|{'cookies' if use_cookies else 'public'}",
+                fetch_reel, reel_url, cache_key, use_cookies,
+                progress_callback=progress_callback, timeout=FLIGHT_TIMEOUT
+            )
+            result = dict(result)
+        except FlightTimeoutError:
+            result = {
+                "success": False,
+                "error": "Timed out waiting for download",
+                "solution": "Try again in a moment"
+            }
+    else:
+        result = fetch_reel(reel_url, None, use_cookies, progress_callback)
+    
+    if preset and result['success'] and not variant_cached:
+        result = get_variant(result, cache_key, preset)
+    
+    elapsed = time.time() - start_time
+    processing_time = round(elapsed, 2)
+    
+    if cached:
+        outcome = 'cached'
+    elif known_failure:
+        outcome = 'known_failure'
+    elif shared:
+        outcome = 'shared'
+    else:
+        outcome = 'success' if result['success'] else 'failed'
+    DOWNLOADS.inc(domain=platform, outcome=outcome)
+    STAGE_SECONDS.observe(elapsed, stage='download', domain=platform, strategy=result.get('strategy', outcome))
+    
+    if result['success']:
+        return {
+            "success": True,
+            "message": "Reel downloaded successfully",
+            "download_url": f"/api/file/{result['filename']}",
+            "filename": result['filename'],
+            "file_size": result.get('file_size', 0),
+            "title": result.get('title', 'reel'),
+            "duration": result.get('duration', 'Unknown'),
+            "thumbnail": result.get('thumbnail'),
+            "cached": cached,
+            "shared": shared,
+            "preset": preset,
+            "processing_time": f"{processing_time}s"
+        }
+    else:
+        failure = {
+            "success": False,
+            "error": result.get('error', 'Download failed'),
+            "solution": result.get('solution', 'Try another reel'),
+            "processing_time": f"{processing_time}s"
+        }
+        if result.get('reason') in PERMANENT_REASONS:
+            failure['reason'] = result['reason']
+        if result.get('retry_after'):
+            failure['retry_after'] = result['retry_after']
+        return failure
+
+def get_reel_info(reel_url, use_cookies=True):
+    """Extract reel info once; repeat lookups are served from the info cache"""
+    cache_key = media_key(reel_url) or reel_url
+    
+    info = info_cache.get(cache_key)
+    CACHE_REQUESTS.inc(cache='info', result='hit' if info else 'miss')
+    if info:
+        return info, True
+    
+    known_failure = negative_cache.get(cache_key)
+    if known_failure:
+        return dict(known_failure, success=False), True
+    
+    cookies = cookie_pool.acquire(reel_url) if use_cookies else None
+    cookie_jar = cookies['jar'] if cookies else None
+    
+    try:
+        with timed(STAGE_SECONDS, stage='info', domain=metric_platform(reel_url)):
+            info, _ = info_flights.do(cache_key, extract_reel_info, reel_url, cookie_jar, timeout=INFO_TIMEOUT)
+    except FlightTimeoutError:
+        return {"success": False, "error": "Timed out waiting for reel info"}, False
+    
+    if info['success']:
+        info_cache.put(cache_key, info)
+    
+    return info, False
 
 @app.route('/api/download', methods=['POST'])
 @limiter.limit("20 per minute")
 def download_reel_endpoint():
-    start_time = time.time()
-    
     try:
         data = request.get_json()
         
@@ -68,44 +335,60 @@ def download_reel_endpoint():
                 "error": "URL cannot be empty"
             }), 400
         
-        if not any(domain in reel_url for domain in ['instagram.com', 'facebook.com', 'fb.watch']):
+        with timed(STAGE_SECONDS, stage='validate', domain=metric_platform(reel_url)):
+            supported = is_supported_url(reel_url)
+        
+        if not supported:
             return jsonify({
                 "success": False,
                 "error": "Please provide Instagram or Facebook URL"
             }), 400
         
+        preset = data.get('preset') or None
+        if preset is not None and (not isinstance(preset, str) or preset not in PRESETS):
+            return jsonify({
+                "success": False,
+                "error": f"Unknown preset; use one of {', '.join(PRESETS)}"
+            }), 400
+        if preset and not transcode_available():
+            return jsonify({
+                "success": False,
+                "error": "Transcoding is not available on this server"
+            }), 501
+        
         logger.info(f"Download request: {reel_url}")
         
-        # Try download with cookies first, then fallback to public
-        use_cookies = data.get('use_cookies', True)
+        # No short link lookup here: that's left to the job
+        cache_key = media_key(reel_url, resolve=False)
+        if cache_key and preset:
+            cache_key = variant_key(cache_key, preset)
+        if not (cache_key and result_cache.has(cache_key)) and storage_manager.saturated():
+            response = jsonify({
+                "success": False,
+                "error": "Server storage is full. Please try again in a few minutes."
+            })
+            response.headers['Retry-After'] = str(JOB_RETRY_AFTER)
+            return response, 507
         
-        if use_cookies:
-            result = download_reel_with_cookies(reel_url, DOWNLOAD_FOLDER, COOKIES_FOLDER)
-        else:
-            result = download_public_reel(reel_url, DOWNLOAD_FOLDER)
-        
-        processing_time = round(time.time() - start_time, 2)
-        
-        if result['success']:
-            response_data = {
-                "success": True,
-                "message": "Reel downloaded successfully",
-                "download_url": f"/api/file/{result['filename']}",
-                "filename": result['filename'],
-                "file_size": result.get('file_size', 0),
-                "title": result.get('title', 'reel'),
-                "duration": result.get('duration', 'Unknown'),
-                "processing_time": f"{processing_time}s"
-            }
-            
-            return jsonify(response_data)
-        else:
-            return jsonify({
+        try:
+            job_id = job_manager.submit(
+                run_download, reel_url, use_cookies=data.get('use_cookies', True), preset=preset
+            )
+        except QueueFullError:
+            response = jsonify({
                 "success": False,
-                "error": result.get('error', 'Download failed'),
-                "solution": result.get('solution', 'Try another reel'),
-                "processing_time": f"{processing_time}s"
-            }), 500
+                "error": "Server is busy. Please try again shortly."
+            })
+            response.headers['Retry-After'] = str(JOB_RETRY_AFTER)
+            return response, 503
+        
+        return jsonify({
+            "success": True,
+            "message": "Download queued",
+            "job_id": job_id,
+            "state": JOB_QUEUED,
+            "status_url": f"/api/jobs/{job_id}"
+        }), 202
             
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}")
@@ -114,27 +397,299 @@ def download_reel_endpoint():
             "error": "Internal server error"
         }), 500
 
+@app.route('/api/jobs/<job_id>')
+@limiter.exempt
+def job_status(job_id):
+    response_data, status_code = job_payload(job_id)
+    return jsonify(response_data), status_code
+
+def job_payload(job_id):
+    """Body and status code of /api/jobs/<job_id>, shared with the ASGI front end"""
+    job = job_manager.get(job_id)
+    
+    if not job:
+        return {"success": False, "error": "Job not found"}, 404
+    
+    return job_body(job), 200
+
+def job_body(job):
+    """Client view of a job snapshot"""
+    response_data = {
+        "success": True,
+        "job_id": job['id'],
+        "state": job['state'],
+        "progress": job['progress'],
+        "created_at": job['created_at'],
+        "started_at": job['started_at'],
+        "finished_at": job['finished_at'],
+    }
+    if job['result'] is not None:
+        response_data['result'] = job['result']
+        if job['result'].get('success'):
+            response_data['download_url'] = job['result']['download_url']
+    
+    return response_data
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def job_finished(job):
+    return job['state'] in (JOB_FINISHED, JOB_FAILED)
+
+@app.route('/api/progress/<job_id>')
+@limiter.exempt
+def job_progress(job_id):
+    """
+    Server-Sent Events: a 'progress' event whenever the job changes, then
+    'done'. The stream closes after SSE_STREAM_LIFETIME seconds and
+    EventSource reconnects on its own.
+    """
+    if not job_manager.get(job_id):
+        return jsonify({"success": False, "error": "Job not found"}), 404
+    
+    def events():
+        yield "retry: 1000\n\n"
+        version = None
+        last_body = None
+        last_write = time.time()
+        close_at = time.time() + SSE_STREAM_LIFETIME
+        
+        while True:
+            wait = min(SSE_KEEPALIVE, max(close_at - time.time(), 0))
+            job, version = job_manager.wait_for_change(job_id, version, wait)
+            if not job:
+                yield sse_event('error', {"success": False, "error": "Job not found"})
+                return
+            
+            body = job_body(job)
+            if job_finished(job):
+                yield sse_event('done', body)
+                return
+            if body != last_body:
+                yield sse_event('progress', body)
+                last_body, last_write = body, time.time()
+            elif time.time() - last_write >= SSE_KEEPALIVE:
+                yield ": keep-alive\n\n"
+                last_write = time.time()
+            
+            if time.time() >= close_at:
+                return
+            
+            # Coalesce bursts of progress ticks; jobs on other workers are polled
+            time.sleep(PROGRESS_EVENT_INTERVAL if version is not None else 1)
+    
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+@app.route('/api/batch', methods=['POST'])
+@limiter.limit("5 per minute")
+def batch_download():
+    """Download many reels; streams NDJSON progress or a ZIP archive"""
+    data = request.get_json(silent=True) or {}
+    urls = data.get('urls')
+    
+    if not isinstance(urls, list) or not urls:
+        return jsonify({"success": False, "error": "Provide a non-empty 'urls' list"}), 400
+    
+    # Indexes refer to the list as sent, blank entries included
+    items = [(index, url.strip()) for index, url in enumerate(urls) if isinstance(url, str) and url.strip()]
+    if len(items) > BATCH_MAX_URLS:
+        return jsonify({"success": False, "error": f"At most {BATCH_MAX_URLS} URLs per batch"}), 400
+    
+    output = data.get('output', 'manifest')
+    if output not in ('manifest', 'zip'):
+        return jsonify({"success": False, "error": "output must be 'manifest' or 'zip'"}), 400
+    
+    use_cookies = data.get('use_cookies', True)
+    unique, duplicates = dedupe_urls(items)
+    logger.info(f"Batch request: {len(unique)} reels ({len(duplicates)} duplicates)")
+    
+    def download(reel_url):
+        if not is_supported_url(reel_url):
+            return {"success": False, "error": "Please provide Instagram or Facebook URL"}
+        return run_download(reel_url, use_cookies)
+    
+    def completed():
+        for index, reel_url, result in run_batch(unique, download):
+            yield dict(result, index=index, url=reel_url)
+    
+    if output == 'zip':
+        def entries():
+            results = []
+            for item in completed():
+                if item['success']:
+                    # Opened here: an open file stays readable if cleanup removes it meanwhile
+                    try:
+                        f = open(file_registry.path(item['filename']), 'rb')
+                    except OSError as e:
+                        logger.warning(f"Batch file {item['filename']} is gone: {str(e)}")
+                        item = dict(item, success=False, error="File no longer available")
+                    else:
+                        file_registry.touch(item['filename'])
+                        ext = os.path.splitext(item['filename'])[1]
+                        yield f"{item['index'] + 1:03d}_{item['title']}{ext}", f
+                results.append(item)
+            yield 'manifest.json', manifest_json(results, duplicates)
+        
+        return Response(
+            stream_with_context(iter_zip(entries())),
+            mimetype='application/zip',
+            headers={'Content-Disposition': 'attachment; filename="reels.zip"'},
+        )
+    
+    def progress():
+        for item in duplicates:
+            yield json.dumps(item) + '\n'
+        results = []
+        for item in completed():
+            results.append(item)
+            yield json.dumps(item) + '\n'
+        yield json.dumps(dict(batch_summary(results, duplicates), done=True)) + '\n'
+    
+    return Response(stream_with_context(progress()), mimetype='application/x-ndjson')
+
+@app.route('/api/info')
+@limiter.limit("60 per minute")
+def reel_info():
+    """Reel metadata, formats and direct media URLs without downloading"""
+    start_time = time.time()
+    reel_url = request.args.get('url', '').strip()
+    
+    if not reel_url or not is_supported_url(reel_url):
+        return jsonify({
+            "success": False,
+            "error": "Please provide Instagram or Facebook URL"
+        }), 400
+    
+    use_cookies = request.args.get('use_cookies', 'true').lower() != 'false'
+    info, cached = get_reel_info(reel_url, use_cookies)
+    processing_time = round(time.time() - start_time, 2)
+    
+    if not info['success']:
+        response = jsonify({
+            "success": False,
+            "error": info.get('error', 'Could not extract reel info'),
+            "processing_time": f"{processing_time}s"
+        })
+        if info.get('retry_after'):
+            # Our own upstream throttle turned the request away
+            response.status_code = 503
+            response.headers['Retry-After'] = str(info['retry_after'])
+            return response
+        response.status_code = 502
+        return response
+    
+    return jsonify(dict(info, cached=cached, processing_time=f"{processing_time}s"))
+
+@app.route('/api/stream')
+@limiter.limit("20 per minute")
+def stream_reel():
+    """Relay a reel from the CDN to the client without staging it on disk"""
+    reel_url = request.args.get('url', '').strip()
+    
+    if not reel_url or not is_supported_url(reel_url):
+        return jsonify({
+            "success": False,
+            "error": "Please provide Instagram or Facebook URL"
+        }), 400
+    
+    use_cookies = request.args.get('use_cookies', 'true').lower() != 'false'
+    media, _ = get_reel_info(reel_url, use_cookies)
+    if not media['success']:
+        return jsonify({
+            "success": False,
+            "error": media.get('error', 'Could not resolve media URL')
+        }), 502
+    
+    try:
+        upstream = open_upstream(media['media_url'], media['http_headers'], request.headers.get('Range'))
+    except requests.RequestException as e:
+        logger.error(f"Upstream connection failed: {str(e)}")
+        return jsonify({"success": False, "error": "Could not reach media server"}), 502
+    
+    if upstream.status_code not in (200, 206):
+        upstream.close()
+        if upstream.status_code == 416:
+            return jsonify({"success": False, "error": "Requested range not satisfiable"}), 416
+        return jsonify({"success": False, "error": "Media server refused the request"}), 502
+    
+    headers = relay_headers(upstream)
+    download_name = f"{media['title']}.{media['ext']}"
+    headers['Content-Disposition'] = f"attachment; filename=\"reel.{media['ext']}\"; filename*=UTF-8''{quote(download_name)}"
+    
+    return Response(
+        stream_with_context(iter_upstream(upstream)),
+        status=upstream.status_code,
+        headers=headers,
+        mimetype=headers.get('Content-Type', 'video/mp4'),
+    )
+
 @app.route('/api/file/<filename>')
 def serve_file(filename):
     try:
-        if '..' in filename or '/' in filename:
-            return jsonify({"error": "Invalid filename"}), 400
-        
-        file_path = os.path.join(DOWNLOAD_FOLDER, filename)
-        
-        if not os.path.exists(file_path):
-            return jsonify({"error": "File not found"}), 404
-        
-        file_age = time.time() - os.path.getctime(file_path)
-        if file_age > MAX_FILE_AGE:
-            os.remove(file_path)
-            return jsonify({"error": "File expired"}), 410
+        with timed(STAGE_SECONDS, stage='serve', domain='', strategy=''):
+            entry, error = lookup_download(filename)
+            if error:
+                return jsonify(error[0]), error[1]
             
-        return send_file(file_path, as_attachment=True, download_name=filename)
+            # Validators come from the registry; werkzeug answers 304s and Range requests
+            response = send_file(
+                os.path.abspath(file_registry.path(filename)),
+                as_attachment=True,
+                download_name=filename,
+                etag=entry['etag'],
+                last_modified=entry['last_modified'],
+                max_age=remaining_lifetime(entry),
+                conditional=True,
+            )
+            file_registry.touch(filename)
         
+        # 304s, 416s and HEAD requests send no body
+        if response.status_code in (200, 206) and request.method != 'HEAD':
+            BYTES_SERVED.inc(response.content_length or 0, endpoint='file')
+        return response
+    
+    except HTTPException:
+        # e.g. 416 for an unsatisfiable Range
+        raise
     except Exception as e:
         return jsonify({"error": "Error serving file"}), 500
 
+def lookup_download(filename):
+    """Registry entry of a servable download as (entry, None), or (None, (error, status code))"""
+    if '..' in filename or '/' in filename:
+        return None, ({"error": "Invalid filename"}, 400)
+    
+    entry = file_registry.lookup(filename)
+    if not entry or not os.path.exists(file_registry.path(filename)):
+        if entry:
+            file_registry.remove(filename, delete_file=False)
+        return None, ({"error": "File not found"}, 404)
+    
+    if entry['expires_at'] < time.time():
+        file_registry.remove(filename)
+        return None, ({"error": "File expired"}, 410)
+    
+    return entry, None
+
+def remaining_lifetime(entry):
+    """Seconds until a download expires, used as its Cache-Control max-age"""
+    return max(int(entry['expires_at'] - time.time()), 0)
+
+@app.route('/metrics')
+@limiter.exempt
+def metrics():
+    """Prometheus metrics"""
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/cookies')
+def cookies_health():
+    """Health of the uploaded cookie files"""
+    return jsonify({"success": True, "cookies": cookie_pool.health()})
+
 @app.route('/api/upload-cookies', methods=['POST'])
 def upload_cookies():
     """Upload cookies file"""
@@ -153,6 +708,10 @@ def upload_cookies():
             
             # Verify file has content
             if os.path.getsize(filepath) > 0:
+                cookie_registry.register(filename)
+                cookie_pool.invalidate(filepath)
+                # Private reels may be downloadable with these
+                negative_cache.invalidate_login_required()
                 return jsonify({
                     "success": True,
                     "message": "Cookies uploaded successfully",
@@ -168,20 +727,16 @@ def upload_cookies():
         return jsonify({"success": False, "error": str(e)}), 500
 
 def cleanup_old_files():
-    """Clean up old files"""
+    """Delete expired downloads and cookies; cached reels expire with their cache entry"""
     try:
-        deleted_count = 0
-        current_time = time.time()
-        
-        for folder in [DOWNLOAD_FOLDER, COOKIES_FOLDER]:
-            for filename in os.listdir(folder):
-                file_path = os.path.join(folder, filename)
-                if os.path.isfile(file_path):
-                    file_age = current_time - os.path.getctime(file_path)
-                    if file_age > MAX_FILE_AGE:
-                        os.remove(file_path)
-                        deleted_count += 1
+        deleted_count = result_cache.evict_expired()
+        deleted_count += file_registry.expire()
+        expired_cookies = cookie_registry.expire()
+        if expired_cookies:
+            cookie_pool.invalidate()
+        deleted_count += expired_cookies
         
+        CLEANUP_DELETED.inc(deleted_count)
         return deleted_count
     except Exception as e:
         logger.error(f"Cleanup error: {str(e)}")
@@ -192,15 +747,94 @@ def background_cleanup():
     while True:
         time.sleep(300)
         try:
+            # Every worker expires what it knows about itself ...
             deleted = cleanup_old_files()
             if deleted > 0:
                 logger.info(f"Cleaned up {deleted} files")
+            # ... and one per host looks after the shared journal and state
+            host_wide = scheduler_lock.acquire()
+            job_manager.cleanup(MAX_FILE_AGE, prune_journal=host_wide)
+            if host_wide:
+                file_registry.compact_journal()
+            if state_backend and host_wide:
+                state_backend.purge_expired()
+            strategy_stats.save()
         except Exception as e:
             logger.error(f"Cleanup error: {str(e)}")
 
-# Start cleanup thread
-cleanup_thread = threading.Thread(target=background_cleanup, daemon=True)
-cleanup_thread.start()
+scheduler_lock = HostLock(SCHEDULER_LOCK)
+background_started = False
+
+def start_background_tasks():
+    """
+    Start this process's background threads and resume the jobs the last
+    shutdown interrupted. Runs at import, or from gunicorn.conf.py in each
+    worker after the fork when the app is preloaded.
+    """
+    global background_started
+    if background_started:
+        return
+    background_started = True
+    started = time.time()
+
+    threading.Thread(target=background_cleanup, daemon=True, name='cleanup').start()
+    # Proxy health checks (no-op without configured proxies)
+    proxy_pool.start_health_checks()
+    if startup['warmup_seconds'] is None:
+        # Load the extractors and build the common yt-dlp profiles off the request path
+        threading.Thread(target=warm_ydl_pool, daemon=True, name='ydl-warmup').start()
+
+    # Take the host-wide chores unless another worker on this host has them
+    scheduler_lock.acquire()
+    # Pick up downloads the last shutdown interrupted, under their old job ids
+    job_manager.resume({'run_download': run_download})
+
+    startup['worker_seconds'] = round(time.time() - started, 3)
+
+startup = {
+    "mode": "preload" if DEFER_BACKGROUND_TASKS else "import",
+    "import_seconds": round(time.time() - BOOT_STARTED, 3),
+    "warmup_seconds": None,
+    "worker_seconds": None,
+}
+
+if DEFER_BACKGROUND_TASKS:
+    # Warm yt-dlp here, before the fork, so every worker shares the loaded
+    # extractors copy-on-write instead of loading its own
+    startup['warmup_seconds'] = round(warm_ydl_pool(), 3)
+else:
+    start_background_tasks()
+logger.info(
+    f"App loaded in {round(time.time() - BOOT_STARTED, 2)}s: imports and setup {startup['import_seconds']}s, "
+    + (f"yt-dlp warm-up {startup['warmup_seconds']}s" if startup['warmup_seconds'] is not None
+       else "yt-dlp warming up in the background")
+)
+
+def shutdown(timeout=SHUTDOWN_GRACE):
+    """
+    Stop taking downloads, leave queued ones in the job journal for the next
+    start and give running ones up to timeout seconds; returns how many are
+    still running
+    """
+    still_running = job_manager.drain(timeout)
+    strategy_stats.save()
+    return still_running
+
+def handle_sigterm(signum, frame):
+    logger.info("SIGTERM received, draining download jobs")
+    if callable(previous_sigterm_handler):
+        # The server (e.g. gunicorn) shuts down gracefully itself; don't hold it up
+        job_manager.drain()
+        previous_sigterm_handler(signum, frame)
+    else:
+        shutdown()
+        raise SystemExit(0)
+
+# Signal handlers can only be installed from the main thread; under
+# gunicorn.conf.py the worker_exit hook calls shutdown() instead
+if threading.current_thread() is threading.main_thread() and not DEFER_BACKGROUND_TASKS:
+    previous_sigterm_handler = signal.getsignal(signal.SIGTERM)
+    signal.signal(signal.SIGTERM, handle_sigterm)
 
 @app.errorhandler(429)
 def ratelimit_handler(e):
@@ -0,0 +1,296 @@
+"""
+ASGI entry point.
+
+    uvicorn asgi:application --host 0.0.0.0 --port $PORT
+
+File downloads, /api/status, /api/jobs/<job_id> and the
+/api/progress/<job_id> event streams are answered on the event loop, so
+thousands of clients fetching files or watching jobs don't need a thread
+each. Everything else (downloads, info, stream, uploads, the UI) is the
+Flask app, run on a thread pool; yt-dlp work already happens on the job
+workers.
+"""
+import os
+import re
+import json
+import time
+import asyncio
+import mimetypes
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from werkzeug.http import http_date, quote_etag, parse_etags, parse_date, parse_range_header, parse_if_range_header
+
+from app import (
+    app, file_registry, job_manager, lookup_download, remaining_lifetime, job_payload, status_payload,
+    job_body, job_finished, sse_event, shutdown, PROGRESS_EVENT_INTERVAL, SSE_KEEPALIVE,
+)
+from utils.metrics import timed, STAGE_SECONDS, BYTES_SERVED
+
+CHUNK_SIZE = 256 * 1024
+WSGI_THREADS = int(os.environ.get('WSGI_THREADS', 32))
+
+FILE_ROUTE = re.compile(r'^/api/file/([^/]+)$')
+JOB_ROUTE = re.compile(r'^/api/jobs/([^/]+)$')
+PROGRESS_ROUTE = re.compile(r'^/api/progress/([^/]+)$')
+
+# Flask-CORS adds this to every Flask response; the native routes match it
+BASE_HEADERS = [(b'access-control-allow-origin', b'*')]
+
+UNSATISFIABLE = object()
+
+wsgi_executor = ThreadPoolExecutor(max_workers=WSGI_THREADS, thread_name_prefix='wsgi')
+
+
+class ThreadedWsgiInstance(WsgiToAsgiInstance):
+    # asgiref runs every WSGI request on one shared thread by default
+    run_wsgi_app = sync_to_async(
+        WsgiToAsgiInstance.__dict__['run_wsgi_app'].func, thread_sensitive=False, executor=wsgi_executor
+    )
+
+
+class ThreadedWsgiToAsgi(WsgiToAsgi):
+    async def __call__(self, scope, receive, send):
+        await ThreadedWsgiInstance(self.wsgi_application)(scope, receive, send)
+
+
+flask_application = ThreadedWsgiToAsgi(app)
+
+
+async def send_json(send, data, status=200):
+    body = json.dumps(data).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': BASE_HEADERS + [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode()),
+        ],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def request_headers(scope):
+    return {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+
+
+def not_modified(headers, entry):
+    """True if the client's cached copy (If-None-Match / If-Modified-Since) is current"""
+    if 'if-none-match' in headers:
+        return parse_etags(headers['if-none-match']).contains_weak(entry['etag'])
+    if 'if-modified-since' in headers:
+        since = parse_date(headers['if-modified-since'])
+        return since is not None and entry['last_modified'] <= since.timestamp()
+    return False
+
+
+def requested_range(headers, entry, size):
+    """
+    (start, stop) of a single satisfiable Range, None to send the whole file,
+    or UNSATISFIABLE. Multiple ranges and stale If-Range get the whole file.
+    """
+    if 'range' not in headers:
+        return None
+
+    if 'if-range' in headers:
+        if_range = parse_if_range_header(headers['if-range'])
+        if if_range.etag is not None and if_range.etag != entry['etag']:
+            return None
+        if if_range.date is not None and if_range.date.timestamp() < entry['last_modified']:
+            return None
+
+    byte_range = parse_range_header(headers['range'])
+    if byte_range is None or len(byte_range.ranges) != 1:
+        return None
+    return byte_range.range_for_length(size) or UNSATISFIABLE
+
+
+async def send_download(scope, send, filename):
+    """Stream a registered download without blocking the event loop, honouring conditional and Range requests"""
+    loop = asyncio.get_running_loop()
+
+    with timed(STAGE_SECONDS, stage='serve', domain='', strategy=''):
+        # May ask the shared state backend (SQLite or Redis); keep that off the loop
+        entry, error = await loop.run_in_executor(None, lookup_download, filename)
+        if error:
+            await send_json(send, *error)
+            return
+        path = os.path.abspath(file_registry.path(filename))
+        try:
+            f = await loop.run_in_executor(None, open, path, 'rb')
+        except OSError:
+            await send_json(send, {"error": "File not found"}, 404)
+            return
+
+    with f:
+        size = os.fstat(f.fileno()).st_size
+        headers = request_headers(scope)
+        max_age = remaining_lifetime(entry)
+        response_headers = BASE_HEADERS + [
+            (b'etag', quote_etag(entry['etag']).encode()),
+            (b'last-modified', http_date(entry['last_modified']).encode()),
+            (b'cache-control', f'public, max-age={max_age}'.encode()),
+            (b'expires', http_date(time.time() + max_age).encode()),
+            (b'accept-ranges', b'bytes'),
+        ]
+
+        if not_modified(headers, entry):
+            await send({'type': 'http.response.start', 'status': 304, 'headers': response_headers})
+            await send({'type': 'http.response.body'})
+            return
+
+        byte_range = requested_range(headers, entry, size)
+        if byte_range is UNSATISFIABLE:
+            await send({
+                'type': 'http.response.start',
+                'status': 416,
+                'headers': response_headers + [(b'content-range', f'bytes */{size}'.encode())],
+            })
+            await send({'type': 'http.response.body'})
+            return
+
+        start, stop = byte_range or (0, size)
+        if byte_range:
+            response_headers.append((b'content-range', f'bytes {start}-{stop - 1}/{size}'.encode()))
+
+        content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        await send({
+            'type': 'http.response.start',
+            'status': 206 if byte_range else 200,
+            'headers': response_headers + [
+                (b'content-type', content_type.encode()),
+                (b'content-length', str(stop - start).encode()),
+                (b'content-disposition', f'attachment; filename="{filename}"'.encode()),
+            ],
+        })
+        file_registry.touch(filename)
+
+        if scope['method'] == 'HEAD':
+            await send({'type': 'http.response.body'})
+            return
+
+        extensions = scope.get('extensions') or {}
+        if 'http.response.zerocopysend' in extensions:
+            # The server sendfile()s straight from our descriptor
+            await send({'type': 'http.response.zerocopysend', 'file': f, 'offset': start, 'count': stop - start})
+            sent = stop - start
+        else:
+            f.seek(start)
+            sent = 0
+            while sent < stop - start:
+                chunk = await loop.run_in_executor(None, f.read, min(CHUNK_SIZE, stop - start - sent))
+                if not chunk:
+                    break
+                sent += len(chunk)
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body'})
+
+    # Only 200 and 206 bodies get here; 304, 416 and HEAD responses carry none
+    BYTES_SERVED.inc(sent, endpoint='file')
+
+
+async def send_progress(receive, send, job_id):
+    """Job progress as Server-Sent Events, polled on the loop so a subscriber doesn't hold a thread"""
+    loop = asyncio.get_running_loop()
+
+    job = await loop.run_in_executor(None, job_manager.get, job_id)
+    if not job:
+        await send_json(send, {"success": False, "error": "Job not found"}, 404)
+        return
+
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': BASE_HEADERS + [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+        ],
+    })
+
+    disconnected = asyncio.Event()
+
+    async def watch_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        disconnected.set()
+
+    async def write(text, more_body=True):
+        await send({'type': 'http.response.body', 'body': text.encode(), 'more_body': more_body})
+
+    watcher = asyncio.ensure_future(watch_disconnect())
+    try:
+        await write("retry: 2000\n\n")
+        last_body = None
+        last_write = time.time()
+
+        while not disconnected.is_set():
+            if not job:
+                await write(sse_event('error', {"success": False, "error": "Job not found"}), more_body=False)
+                return
+
+            body = job_body(job)
+            if job_finished(job):
+                await write(sse_event('done', body), more_body=False)
+                return
+            if body != last_body:
+                await write(sse_event('progress', body))
+                last_body, last_write = body, time.time()
+            elif time.time() - last_write >= SSE_KEEPALIVE:
+                await write(": keep-alive\n\n")
+                last_write = time.time()
+
+            try:
+                await asyncio.wait_for(disconnected.wait(), PROGRESS_EVENT_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            job = await loop.run_in_executor(None, job_manager.get, job_id)
+    finally:
+        watcher.cancel()
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            # Let running downloads finish; queued ones stay in the job journal
+            await asyncio.get_running_loop().run_in_executor(None, shutdown)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+
+    if scope['type'] == 'http' and scope['method'] in ('GET', 'HEAD'):
+        path = scope['path']
+
+        match = FILE_ROUTE.match(path)
+        if match:
+            await send_download(scope, send, match.group(1))
+            return
+
+        if path == '/api/status':
+            # Collecting the stats takes several locks; keep that off the loop
+            payload = await asyncio.get_running_loop().run_in_executor(None, status_payload)
+            await send_json(send, payload)
+            return
+
+        match = JOB_ROUTE.match(path)
+        if match:
+            # Jobs run by other workers are read from the shared state backend
+            payload = await asyncio.get_running_loop().run_in_executor(None, job_payload, match.group(1))
+            await send_json(send, *payload)
+            return
+
+        match = PROGRESS_ROUTE.match(path)
+        if match:
+            await send_progress(receive, send, match.group(1))
+            return
+
+    await flask_application(scope, receive, send)
@@ -0,0 +1,230 @@
+"""
+Local stand-in for the Instagram/Facebook extractor and CDN.
+
+FakeOrigin serves canned extractor responses and MP4 payloads over HTTP with
+configurable size, latency and failure rates. FakeYoutubeDL mimics the parts
+of yt_dlp.YoutubeDL the downloader uses and talks to FakeOrigin instead of
+the real sites, so the whole pipeline can be measured offline.
+"""
+import os
+import re
+import json
+import time
+import random
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import requests
+
+CHUNK_SIZE = 64 * 1024
+
+# Strategy name from the output filename, e.g. reel_simple_<uuid>.mp4 or public_<uuid>.mp4
+STRATEGY_FILENAME_RE = re.compile(r'^(?:reel_([a-z]+)_|(public)_)')
+
+
+class FakeOrigin:
+    """Threaded HTTP server answering /info/<media_id> and /media/<media_id>.mp4"""
+
+    def __init__(self, media_size=1024 * 1024, info_latency=0.2, media_latency=0.05,
+                 failure_rates=None):
+        self.media_size = media_size
+        self.info_latency = info_latency
+        self.media_latency = media_latency
+        self.failure_rates = failure_rates or {}
+        self.payload = os.urandom(min(media_size, CHUNK_SIZE))
+        self.requests = {'info': 0, 'media': 0}
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True, name='fake-origin').start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+    def count(self, kind):
+        with self.lock:
+            self.requests[kind] += 1
+
+    def _handler(self):
+        origin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                parts = parsed.path.strip('/').split('/')
+                if len(parts) == 2 and parts[0] == 'info':
+                    self.send_info(parts[1], parse_qs(parsed.query))
+                elif len(parts) == 2 and parts[0] == 'media':
+                    self.send_media()
+                else:
+                    self.send_json(404, {"error": "not found"})
+
+            def send_json(self, status, data):
+                body = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def send_info(self, media_id, query):
+                origin.count('info')
+                time.sleep(origin.info_latency)
+
+                strategy = query.get('strategy', [''])[0]
+                if random.random() < origin.failure_rates.get(strategy, 0):
+                    self.send_json(500, {"error": f"Injected failure for {strategy}"})
+                    return
+
+                media_url = f"{origin.base_url}/media/{media_id}.mp4"
+                self.send_json(200, {
+                    "id": media_id,
+                    "title": f"Benchmark reel {media_id}",
+                    "duration": 15,
+                    "thumbnail": f"{origin.base_url}/media/{media_id}.jpg",
+                    "ext": "mp4",
+                    "url": media_url,
+                    "format_id": "fake",
+                    "filesize": origin.media_size,
+                    "http_headers": {},
+                    "formats": [{"format_id": "fake", "ext": "mp4", "url": media_url,
+                                 "filesize": origin.media_size, "vcodec": "h264", "acodec": "aac"}],
+                })
+
+            def send_media(self):
+                origin.count('media')
+                time.sleep(origin.media_latency)
+
+                size = origin.media_size
+                start, end = 0, size - 1
+                range_header = self.headers.get('Range', '')
+                match = re.match(r'bytes=(\d*)-(\d*)', range_header)
+                if match and (match.group(1) or match.group(2)):
+                    if match.group(1):
+                        start = int(match.group(1))
+                        end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+                    else:
+                        # Suffix range: the last N bytes
+                        start = max(size - int(match.group(2)), 0)
+                    self.send_response(206)
+                    self.send_header('Content-Range', f"bytes {start}-{end}/{size}")
+                else:
+                    self.send_response(200)
+
+                self.send_header('Content-Type', 'video/mp4')
+                self.send_header('Content-Length', str(end - start + 1))
+                self.send_header('Accept-Ranges', 'bytes')
+                self.end_headers()
+
+                remaining = end - start + 1
+                while remaining > 0:
+                    chunk = origin.payload[:min(remaining, len(origin.payload))]
+                    self.wfile.write(chunk)
+                    remaining -= len(chunk)
+
+        return Handler
+
+
+def media_id_from_url(url):
+    """Last meaningful path segment of a reel URL"""
+    return [part for part in urlparse(url).path.split('/') if part][-1]
+
+
+def make_fake_youtube_dl(origin):
+    """A YoutubeDL stand-in class bound to origin"""
+
+    session = requests.Session()
+
+    class FakeInfoExtractor:
+        def __init__(self, ie_key):
+            self.ie_key = ie_key
+            self._ready = False
+
+        def initialize(self):
+            self._ready = True
+
+    class FakeYoutubeDL:
+        def __init__(self, params=None):
+            self.params = dict(params or {})
+            self._progress_hooks = list(self.params.get('progress_hooks') or [])
+            self._ies = {}
+            self.cookiejar = None
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            self.close()
+
+        def close(self):
+            pass
+
+        def get_info_extractor(self, ie_key):
+            if ie_key not in self._ies:
+                self._ies[ie_key] = FakeInfoExtractor(ie_key)
+            return self._ies[ie_key]
+
+        def add_progress_hook(self, hook):
+            self._progress_hooks.append(hook)
+
+        def _outtmpl(self):
+            outtmpl = self.params.get('outtmpl') or 'fake.mp4'
+            return outtmpl['default'] if isinstance(outtmpl, dict) else outtmpl
+
+        def _strategy(self):
+            match = STRATEGY_FILENAME_RE.match(os.path.basename(self._outtmpl()))
+            return (match.group(1) or match.group(2)) if match else 'info'
+
+        def extract_info(self, url, download=True, **kwargs):
+            response = session.get(
+                f"{origin.base_url}/info/{media_id_from_url(url)}",
+                params={'strategy': self._strategy()},
+                timeout=self.params.get('socket_timeout', 30),
+            )
+            if response.status_code != 200:
+                raise Exception(f"ERROR: {response.json().get('error')}")
+
+            info = response.json()
+            if download:
+                info = self.process_ie_result(info, download=True)
+            return info
+
+        def process_ie_result(self, info, download=True, **kwargs):
+            if not download:
+                return info
+
+            filepath = self._outtmpl()
+            downloaded = 0
+            with session.get(info['url'], stream=True, timeout=30) as response:
+                total = int(response.headers.get('Content-Length', 0))
+                with open(filepath, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                        f.write(chunk)
+                        downloaded += len(chunk)
+                        for hook in self._progress_hooks:
+                            hook({'status': 'downloading', 'downloaded_bytes': downloaded,
+                                  'total_bytes': total, 'filename': filepath})
+
+            for hook in self._progress_hooks:
+                hook({'status': 'finished', 'downloaded_bytes': downloaded,
+                      'total_bytes': total, 'filename': filepath})
+
+            return dict(info, requested_downloads=[{'filepath': filepath}])
+
+        def prepare_filename(self, info):
+            return self._outtmpl()
+
+    return FakeYoutubeDL
@@ -0,0 +1,255 @@
+"""
+Load and latency benchmark for the download pipeline.
+
+Runs the Flask app in-process against a local fake media origin (see
+fake_origin.py) and drives /api/download, /api/jobs/<id> and
+/api/file/<filename> with a configurable number of concurrent clients.
+
+    python -m benchmarks.run --requests 200 --concurrency 16 --media-size 2000000
+
+Reports requests/s, latency percentiles, bytes/s served, disk usage and
+failure rates per download strategy.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+POLL_INTERVAL = 0.05
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(int(round(pct / 100.0 * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+def folder_size(folder):
+    total = 0
+    for entry in os.scandir(folder):
+        if entry.is_file():
+            total += entry.stat().st_size
+    return total
+
+
+def parse_failure_rates(values):
+    """['simple=0.5', 'cookies=1'] -> {'simple': 0.5, 'cookies': 1.0}"""
+    rates = {}
+    for value in values or []:
+        name, _, rate = value.partition('=')
+        rates[name] = float(rate)
+    return rates
+
+
+def setup_app(origin, workdir, job_workers):
+    """Import the app inside workdir with yt-dlp replaced by the fake extractor"""
+    os.chdir(workdir)
+    os.environ['JOB_WORKERS'] = str(job_workers)
+    os.environ['STRATEGY_STATS_FILE'] = os.path.join(workdir, 'strategy_stats.json')
+    os.environ.pop('PROXY_LIST', None)
+    os.environ.pop('PROXY_FILE', None)
+    os.environ.pop('PROXY_SERVICE_URL', None)
+
+    import yt_dlp
+    from benchmarks.fake_origin import make_fake_youtube_dl
+
+    yt_dlp.YoutubeDL = make_fake_youtube_dl(origin)
+
+    sys.path.insert(0, REPO_ROOT)
+    import app as app_module
+
+    app_module.limiter.enabled = False
+    return app_module
+
+
+def run_client(app_module, url, timeout):
+    """One user: queue a download, poll the job, fetch the file"""
+    client = app_module.app.test_client()
+    sample = {"url": url, "success": False, "bytes": 0, "rejected": 0}
+    started = time.time()
+
+    while True:
+        response = client.post('/api/download', json={"url": url})
+        if response.status_code != 503:
+            break
+        sample['rejected'] += 1
+        time.sleep(float(response.headers.get('Retry-After', 1)) / 10)
+
+    if response.status_code != 202:
+        sample['error'] = f"HTTP {response.status_code}"
+        sample['total_latency'] = time.time() - started
+        return sample
+
+    status_url = response.get_json()['status_url']
+    deadline = started + timeout
+    job = {}
+    while time.time() < deadline:
+        job = client.get(status_url).get_json()
+        if job.get('result'):
+            break
+        time.sleep(POLL_INTERVAL)
+
+    sample['download_latency'] = time.time() - started
+    result = job.get('result') or {"success": False, "error": "Timed out"}
+    sample['cached'] = result.get('cached', False)
+    sample['shared'] = result.get('shared', False)
+
+    if not result.get('success'):
+        sample['error'] = result.get('error')
+        sample['total_latency'] = time.time() - started
+        return sample
+
+    serve_started = time.time()
+    response = client.get(result['download_url'])
+    sample['bytes'] = len(response.data)
+    sample['serve_latency'] = time.time() - serve_started
+    sample['total_latency'] = time.time() - started
+    sample['success'] = response.status_code == 200
+    if not sample['success']:
+        sample['error'] = f"File HTTP {response.status_code}"
+    return sample
+
+
+def summarize(samples, elapsed, disk_peak, disk_end, origin, strategy_stats):
+    def latency_block(key):
+        values = [s[key] for s in samples if key in s]
+        return {
+            "p50": percentile(values, 50),
+            "p90": percentile(values, 90),
+            "p99": percentile(values, 99),
+            "max": max(values) if values else None,
+        }
+
+    failures = [s for s in samples if not s['success']]
+    total_bytes = sum(s['bytes'] for s in samples)
+
+    strategies = {}
+    for key, stats in strategy_stats.items():
+        _, name, _ = key.split('|', 2)
+        entry = strategies.setdefault(name, {"attempts": 0, "successes": 0})
+        entry['attempts'] += stats['attempts']
+        entry['successes'] += stats['successes']
+    for entry in strategies.values():
+        entry['failure_rate'] = round(1 - entry['successes'] / entry['attempts'], 3) if entry['attempts'] else None
+
+    return {
+        "requests": len(samples),
+        "elapsed": round(elapsed, 3),
+        "requests_per_second": round(len(samples) / elapsed, 2) if elapsed else None,
+        "failures": len(failures),
+        "failure_rate": round(len(failures) / len(samples), 3) if samples else None,
+        "rejected_503": sum(s['rejected'] for s in samples),
+        "cache_hits": sum(1 for s in samples if s.get('cached')),
+        "coalesced": sum(1 for s in samples if s.get('shared')),
+        "bytes_served": total_bytes,
+        "bytes_per_second": round(total_bytes / elapsed) if elapsed else None,
+        "latency": {
+            "download": latency_block('download_latency'),
+            "serve": latency_block('serve_latency'),
+            "total": latency_block('total_latency'),
+        },
+        "disk": {"peak_bytes": disk_peak, "end_bytes": disk_end},
+        "origin_requests": dict(origin.requests),
+        "strategies": strategies,
+        "errors": sorted({s.get('error') for s in failures if s.get('error')}),
+    }
+
+
+def print_report(report):
+    print(f"Requests:        {report['requests']} in {report['elapsed']}s "
+          f"({report['requests_per_second']} req/s)")
+    print(f"Failures:        {report['failures']} ({report['failure_rate']}), "
+          f"503 rejections: {report['rejected_503']}")
+    print(f"Cache hits:      {report['cache_hits']}, coalesced: {report['coalesced']}")
+    print(f"Bytes served:    {report['bytes_served']} ({report['bytes_per_second']} B/s)")
+    for stage, block in report['latency'].items():
+        values = ', '.join(
+            f"{name}={value * 1000:.1f}ms" if value is not None else f"{name}=n/a"
+            for name, value in block.items()
+        )
+        print(f"Latency {stage + ':':<9}{values}")
+    print(f"Disk:            peak {report['disk']['peak_bytes']} B, end {report['disk']['end_bytes']} B")
+    print(f"Origin requests: {report['origin_requests']}")
+    for name, entry in sorted(report['strategies'].items()):
+        print(f"Strategy {name + ':':<8}{entry['attempts']} attempts, failure rate {entry['failure_rate']}")
+    for error in report['errors']:
+        print(f"Error:           {error}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=100, help='total client requests')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent clients')
+    parser.add_argument('--unique', type=int, default=20, help='distinct reels requested')
+    parser.add_argument('--media-size', type=int, default=1024 * 1024, help='bytes per reel')
+    parser.add_argument('--info-latency', type=float, default=0.2, help='seconds per extractor call')
+    parser.add_argument('--media-latency', type=float, default=0.05, help='seconds before media bytes start')
+    parser.add_argument('--fail', action='append', metavar='STRATEGY=RATE',
+                        help='inject failures for a strategy, e.g. --fail cookies=1 (repeatable)')
+    parser.add_argument('--job-workers', type=int, default=4, help='JOB_WORKERS for the app')
+    parser.add_argument('--timeout', type=float, default=120, help='seconds a client waits for its job')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args(argv)
+
+    from benchmarks.fake_origin import FakeOrigin
+
+    origin = FakeOrigin(
+        media_size=args.media_size,
+        info_latency=args.info_latency,
+        media_latency=args.media_latency,
+        failure_rates=parse_failure_rates(args.fail),
+    ).start()
+
+    workdir = tempfile.mkdtemp(prefix='reels-bench-')
+    try:
+        app_module = setup_app(origin, workdir, args.job_workers)
+        urls = [
+            f"https://www.instagram.com/reel/BENCH{i % args.unique:05d}/"
+            for i in range(args.requests)
+        ]
+
+        disk_peak = 0
+        sampling = True
+
+        def sample_disk():
+            nonlocal disk_peak
+            while sampling:
+                disk_peak = max(disk_peak, folder_size(app_module.DOWNLOAD_FOLDER))
+                time.sleep(0.1)
+
+        sampler = threading.Thread(target=sample_disk, daemon=True)
+        sampler.start()
+
+        started = time.time()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            samples = list(executor.map(lambda url: run_client(app_module, url, args.timeout), urls))
+        elapsed = time.time() - started
+
+        sampling = False
+        sampler.join()
+        disk_end = folder_size(app_module.DOWNLOAD_FOLDER)
+        disk_peak = max(disk_peak, disk_end)
+
+        report = summarize(samples, elapsed, disk_peak, disk_end, origin,
+                           app_module.strategy_stats.snapshot())
+        if args.json:
+            print(json.dumps(report, indent=2))
+        else:
+            print_report(report)
+        return report
+    finally:
+        origin.stop()
+        os.chdir(REPO_ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Gunicorn settings for a fast worker boot:
+
+    gunicorn -c gunicorn.conf.py app:app
+
+The app, Flask, Flask-Limiter and yt-dlp with its Instagram/Facebook
+extractors are loaded once in the master; workers are forked from it and
+share those pages copy-on-write, so a new worker serves its first request
+without importing anything. Threads don't survive a fork, so each worker
+starts its background tasks in post_fork, and one worker per host runs the
+host-wide chores (see SCHEDULER_LOCK).
+"""
+import os
+import time
+import logging
+
+# Read by app.py at import: warm yt-dlp now and leave the threads to post_fork
+os.environ['DEFER_BACKGROUND_TASKS'] = '1'
+
+config_loaded_at = time.time()
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+preload_app = True
+# Threaded workers: a progress stream or a slow file transfer holds one
+# thread, not the whole worker
+worker_class = 'gthread'
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+# Longer than any single request is expected to take, including a progress
+# stream (SSE_STREAM_LIFETIME) and a large file download on a slow link
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+# Running downloads get SHUTDOWN_GRACE seconds to finish before the worker is killed
+graceful_timeout = int(os.environ.get('SHUTDOWN_GRACE', 25)) + 5
+
+logger = logging.getLogger('gunicorn.error')
+
+
+def when_ready(server):
+    import app
+
+    logger.info(
+        f"Startup: master ready in {round(time.time() - config_loaded_at, 2)}s "
+        f"(app {app.startup['import_seconds']}s, yt-dlp warm-up {app.startup['warmup_seconds']}s), "
+        f"forking {server.num_workers} workers"
+    )
+
+
+def post_fork(server, worker):
+    import app
+
+    app.start_background_tasks()
+    logger.info(f"Startup: worker {worker.pid} ready in {app.startup['worker_seconds']}s after fork")
+
+
+def worker_exit(server, worker):
+    # Gunicorn replaces the app's SIGTERM handler in workers; drain here instead
+    import app
+
+    still_running = app.shutdown()
+    if still_running:
+        logger.warning(f"Worker {worker.pid} exiting with {still_running} downloads still running")
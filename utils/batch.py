@@ -0,0 +1,141 @@
+import os
+import json
+import zipfile
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from utils.urls import canonical_media_id
+from utils.throttle import run_in_lane, LANE_BACKGROUND
+
+logger = logging.getLogger(__name__)
+
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', 4))
+BATCH_PARALLEL = 4  # downloads one batch may have running at once
+ZIP_CHUNK_SIZE = 256 * 1024
+
+# Shared by all batches, so batches can't take over the interactive job workers
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix='batch')
+
+
+def dedupe_urls(items):
+    """
+    Split (index, url) pairs into the first item for each reel and the rest.
+    Returns (unique, duplicates); each duplicate is an
+    {"index", "url", "duplicate_of"} entry naming the index of its first occurrence.
+    """
+    first = {}
+    unique = []
+    duplicates = []
+    for index, url in items:
+        key = canonical_media_id(url) or url
+        if key in first:
+            duplicates.append({"index": index, "url": url, "duplicate_of": first[key]})
+            continue
+        first[key] = index
+        unique.append((index, url))
+    return unique, duplicates
+
+
+def run_batch(items, func, max_parallel=BATCH_PARALLEL):
+    """
+    Run func(url) for every (index, url) pair with at most max_parallel
+    running at once. Yields (index, url, result) in completion order.
+    Closing the generator (e.g. the client went away) cancels the items
+    that haven't started. Upstream requests are queued behind interactive
+    downloads.
+    """
+    waiting = list(items)
+    pending = {}
+
+    try:
+        while waiting or pending:
+            while waiting and len(pending) < max_parallel:
+                index, url = waiting.pop(0)
+                pending[batch_executor.submit(run_in_lane, LANE_BACKGROUND, func, url)] = (index, url)
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, url = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.error(f"Batch item {url} crashed: {str(e)}")
+                    result = {"success": False, "error": "Internal server error"}
+                yield index, url, result
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+class ZipStream:
+    """
+    Write-only file object collecting what zipfile writes, so the archive
+    can be sent as it's built. It has no seek()/tell(), which makes zipfile
+    use data descriptors instead of rewriting local headers.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def iter_zip(entries):
+    """
+    Stream a ZIP archive of entries, an iterable of (arcname, path),
+    (arcname, bytes) or (arcname, open binary file, closed here), without
+    holding more than one chunk in memory. Media is stored uncompressed
+    since MP4 doesn't compress further.
+    """
+    stream = ZipStream()
+    with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for arcname, source in entries:
+            if isinstance(source, bytes):
+                archive.writestr(arcname, source)
+            else:
+                if isinstance(source, str):
+                    try:
+                        f = open(source, 'rb')
+                    except OSError as e:
+                        logger.warning(f"Skipping {arcname} in archive: {str(e)}")
+                        continue
+                else:
+                    f = source
+                with f, archive.open(arcname, 'w', force_zip64=True) as member:
+                    while True:
+                        chunk = f.read(ZIP_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        member.write(chunk)
+                        data = stream.drain()
+                        if data:
+                            yield data
+            data = stream.drain()
+            if data:
+                yield data
+    yield stream.drain()
+
+
+def batch_summary(results, duplicates):
+    return {
+        "total": len(results),
+        "succeeded": sum(1 for item in results if item['success']),
+        "failed": sum(1 for item in results if not item['success']),
+        "duplicates": len(duplicates),
+    }
+
+
+def manifest_json(results, duplicates):
+    """Manifest of a finished batch, results and duplicates in input order"""
+    items = sorted(results + duplicates, key=lambda item: item['index'])
+    return json.dumps(dict(batch_summary(results, duplicates), items=items), indent=2).encode()
@@ -0,0 +1,407 @@
+import os
+import time
+import threading
+import logging
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs
+
+logger = logging.getLogger(__name__)
+
+# Metadata kept alongside each cached file
+CACHED_FIELDS = ('filename', 'file_size', 'title', 'duration', 'thumbnail', 'quality')
+
+# Signed CDN URLs are treated as expired this many seconds early
+EXPIRY_MARGIN = 60
+
+# Failure reasons (from handle_download_error) that retrying won't fix
+PERMANENT_REASONS = ('not_found', 'login_required', 'age_restricted')
+NEGATIVE_FIELDS = ('error', 'reason', 'solution')
+
+
+def url_expiry(url):
+    """
+    Return the unix time at which a signed CDN URL stops working, or None.
+    Instagram/Facebook CDNs carry it as a hex 'oe' parameter; others use 'expires'.
+    """
+    try:
+        query = {key.lower(): values[0] for key, values in parse_qs(urlparse(url).query).items()}
+
+        if 'oe' in query:
+            return int(query['oe'], 16)
+        if 'expires' in query:
+            return int(query['expires'])
+
+        return None
+
+    except (ValueError, TypeError):
+        return None
+
+
+class ResultCache:
+    """
+    Finished downloads keyed by canonical media id.
+
+    Each entry owns one file in the download folder. An entry lives for
+    ``ttl`` seconds after it was last requested, and the least recently
+    requested entries are evicted once the cached files exceed
+    ``max_bytes``. With a file ``registry`` the cache keeps each file's
+    registered expiry in step with its entry, deletes evicted files
+    through it, and forgets entries whose file the registry removed.
+
+    With a shared ``state`` backend the index is mirrored there, so a reel
+    downloaded by one worker is a hit on every worker that can see the
+    download folder, and an entry another worker kept alive isn't expired.
+    """
+
+    def __init__(self, download_folder, ttl, max_bytes, registry=None, state=None):
+        self.download_folder = download_folder
+        self.registry = registry
+        self.state = state
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.by_filename = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        # Reentrant: removing a file through the registry calls back into forget()
+        self.lock = threading.RLock()
+
+        if registry:
+            registry.on_remove(self.forget)
+
+    def get(self, key):
+        """Return the cached metadata dict for key, or None"""
+        with self.lock:
+            entry = self.entries.get(key)
+            now = time.time()
+
+            if entry and entry['expires_at'] < now:
+                entry['expires_at'] = self._shared_entry(key) or entry['expires_at']
+            if entry and (entry['expires_at'] < now or not os.path.exists(self._path(entry))):
+                self._remove(key, delete_file=True)
+                entry = None
+
+            if not entry:
+                entry = self._adopt_shared(key)
+
+            if not entry:
+                self.misses += 1
+                return None
+
+            entry['expires_at'] = now + self.ttl
+            self.entries.move_to_end(key)
+            self.hits += 1
+            if self.registry:
+                self.registry.set_expiry(entry['metadata']['filename'], entry['expires_at'])
+            self._publish(key, entry)
+            return dict(entry['metadata'])
+
+    def has(self, key):
+        """True if key has a live entry; unlike get() this doesn't count or refresh it"""
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry is not None and entry['expires_at'] >= time.time()
+
+    def put(self, key, result):
+        """Take ownership of a successful download result's file"""
+        metadata = {field: result[field] for field in CACHED_FIELDS if field in result}
+        if 'filename' not in metadata:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+
+            entry = self._add(key, metadata)
+            if self.registry:
+                self.registry.set_expiry(metadata['filename'], entry['expires_at'])
+            self._publish(key, entry)
+
+            self._evict_over_budget()
+
+    def forget(self, filename):
+        """Drop the entry owning filename without touching the file"""
+        with self.lock:
+            key = self.by_filename.get(filename)
+            if key is not None:
+                self._remove(key)
+
+    def evict_expired(self):
+        """Drop expired entries and delete their files; returns the number removed"""
+        now = time.time()
+        with self.lock:
+            expired = [key for key, entry in self.entries.items() if entry['expires_at'] < now]
+            for key in list(expired):
+                shared = self._shared_entry(key)
+                if shared:
+                    # Another worker served it recently; keep it as long as they do
+                    self.entries[key]['expires_at'] = shared
+                    expired.remove(key)
+                    continue
+                self._remove(key, delete_file=True)
+        return len(expired)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def _evict_over_budget(self):
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            key = next(iter(self.entries))
+            logger.info(f"Evicting cached reel {key}")
+            self._remove(key, delete_file=True)
+
+    def _add(self, key, metadata, expires_at=None):
+        entry = {
+            "key": key,
+            "metadata": metadata,
+            "expires_at": expires_at or time.time() + self.ttl,
+        }
+        self.entries[key] = entry
+        self.by_filename[metadata['filename']] = key
+        self.total_bytes += metadata.get('file_size', 0)
+        return entry
+
+    def _remove(self, key, delete_file=False):
+        entry = self.entries.pop(key)
+        filename = entry['metadata']['filename']
+        self.by_filename.pop(filename, None)
+        self.total_bytes -= entry['metadata'].get('file_size', 0)
+        self._unpublish(key)
+
+        if delete_file and self.registry:
+            self.registry.remove(filename)
+        elif delete_file:
+            try:
+                os.remove(self._path(entry))
+            except OSError:
+                pass
+
+    def _path(self, entry):
+        return os.path.join(self.download_folder, entry['metadata']['filename'])
+
+    def _publish(self, key, entry):
+        if not self.state:
+            return
+        try:
+            self.state.set(f"cache:{key}", entry['metadata'], ttl=entry['expires_at'] - time.time())
+        except Exception as e:
+            logger.warning(f"Could not publish cached reel {key}: {str(e)}")
+
+    def _unpublish(self, key):
+        if not self.state:
+            return
+        try:
+            self.state.delete(f"cache:{key}")
+        except Exception as e:
+            logger.warning(f"Could not unpublish cached reel {key}: {str(e)}")
+
+    def _shared_entry(self, key):
+        """Expiry of key in the shared state if it's later than ours, else None"""
+        if not self.state:
+            return None
+        try:
+            expires_at = self.state.expires_at(f"cache:{key}")
+        except Exception as e:
+            logger.warning(f"Could not read cached reel {key} from shared state: {str(e)}")
+            return None
+        entry = self.entries.get(key)
+        if expires_at and entry and expires_at > entry['expires_at']:
+            return expires_at
+        return None
+
+    def _adopt_shared(self, key):
+        """Take over an entry another worker cached, if its file is visible here"""
+        if not self.state:
+            return None
+        try:
+            metadata = self.state.get(f"cache:{key}")
+        except Exception as e:
+            logger.warning(f"Could not read cached reel {key} from shared state: {str(e)}")
+            return None
+        if not metadata or not os.path.exists(os.path.join(self.download_folder, metadata['filename'])):
+            return None
+        if self.registry and not self.registry.lookup(metadata['filename']):
+            return None
+        return self._add(key, metadata)
+
+
+class TTLCache:
+    """
+    Thread-safe LRU mapping whose entries each carry their own expiry time.
+    At most ``max_entries`` are kept, least recently used first out.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def lookup(self, key):
+        """(found, value) without counting a hit or miss"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return False, None
+            if entry[0] <= time.time():
+                del self.entries[key]
+                return False, None
+            self.entries.move_to_end(key)
+            return True, entry[1]
+
+    def get(self, key):
+        """The value for key or None, counted as a hit or miss"""
+        found, value = self.lookup(key)
+        self.count(found)
+        return value
+
+    def count(self, hit):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def put(self, key, value, expires_at):
+        with self.lock:
+            self.entries[key] = (expires_at, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def discard_if(self, predicate):
+        """Drop every entry whose value predicate(value) is true"""
+        with self.lock:
+            for key in [key for key, (_, value) in self.entries.items() if predicate(value)]:
+                del self.entries[key]
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+class InfoCache:
+    """
+    Short-lived cache of extracted reel info keyed by canonical media id.
+
+    An entry expires after ``ttl`` seconds or just before the earliest
+    signed media URL it contains stops working, whichever comes first.
+    At most ``max_entries`` entries are kept, least recently used first out.
+    """
+
+    def __init__(self, ttl, max_entries=1000):
+        self.ttl = ttl
+        self.entries = TTLCache(max_entries)
+
+    def get(self, key):
+        """Return the cached info dict for key, or None"""
+        return self.entries.get(key)
+
+    def put(self, key, info):
+        """Cache a successful info lookup until its media URLs expire"""
+        now = time.time()
+        expires_at = now + self.ttl
+
+        urls = [info.get('media_url')] + [f.get('url') for f in info.get('formats', [])]
+        for url in urls:
+            expiry = url_expiry(url) if url else None
+            if expiry:
+                expires_at = min(expires_at, expiry - EXPIRY_MARGIN)
+
+        if expires_at <= now:
+            return
+        self.entries.put(key, info, expires_at)
+
+    def stats(self):
+        return self.entries.stats()
+
+
+class NegativeCache:
+    """
+    Reels that failed for a permanent reason (removed, private,
+    age-restricted), keyed by canonical media id, so repeat requests are
+    answered without running the download cascade again.
+
+    An entry expires after ``ttl`` seconds. 'login_required' entries are
+    also dropped when new cookies arrive (invalidate_login_required), since
+    those may let the download through. With a shared ``state`` backend
+    entries are seen by every worker.
+    """
+
+    def __init__(self, ttl, max_entries=10000, state=None):
+        self.ttl = ttl
+        self.state = state
+        self.entries = TTLCache(max_entries)
+        self.cookies_generation = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Return the remembered failure for key, or None"""
+        _, entry = self.entries.lookup(key)
+
+        if entry is None and self.state:
+            try:
+                entry = self.state.get(f"negative:{key}")
+            except Exception as e:
+                logger.warning(f"Could not read negative cache entry {key}: {str(e)}")
+
+        if entry and entry['result']['reason'] == 'login_required':
+            if entry['cookies_generation'] != self._cookies_generation():
+                entry = None
+
+        self.entries.count(entry is not None)
+        return dict(entry['result']) if entry else None
+
+    def put(self, key, result):
+        """Remember a failed result if its reason is permanent; returns True if it was stored"""
+        if result.get('success') or result.get('reason') not in PERMANENT_REASONS:
+            return False
+
+        entry = {
+            "result": {field: result[field] for field in NEGATIVE_FIELDS if field in result},
+            "expires_at": time.time() + self.ttl,
+            "cookies_generation": self._cookies_generation(),
+        }
+        self.entries.put(key, entry, entry['expires_at'])
+
+        if self.state:
+            try:
+                self.state.set(f"negative:{key}", entry, ttl=self.ttl)
+            except Exception as e:
+                logger.warning(f"Could not publish negative cache entry {key}: {str(e)}")
+        return True
+
+    def invalidate_login_required(self):
+        """New cookies may open up private reels; forget those failures"""
+        with self.lock:
+            self.cookies_generation += 1
+        self.entries.discard_if(lambda entry: entry['result']['reason'] == 'login_required')
+        if self.state:
+            try:
+                self.state.incr("negative:cookies_generation")
+            except Exception as e:
+                logger.warning(f"Could not invalidate shared negative cache: {str(e)}")
+
+    def stats(self):
+        return self.entries.stats()
+
+    def _cookies_generation(self):
+        if self.state:
+            try:
+                return int(self.state.get("negative:cookies_generation") or 0)
+            except Exception as e:
+                logger.warning(f"Could not read shared negative cache state: {str(e)}")
+        return self.cookies_generation
@@ -0,0 +1,98 @@
+import os
+import time
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+BREAKER_FAILURES = int(os.environ.get('BREAKER_FAILURES', 5))  # failures in a row that open a breaker
+BREAKER_COOLDOWN = int(os.environ.get('BREAKER_COOLDOWN', 120))  # seconds an open breaker skips its strategy
+BREAKER_TRIAL_TIMEOUT = 60  # seconds before a trial that never reported is given up on
+
+# Breaker states
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreakers:
+    """
+    One circuit breaker per key, e.g. (domain, strategy name).
+
+    A breaker opens after ``failures`` failures in a row and then refuses
+    its key for ``cooldown`` seconds. After that a single trial call is
+    allowed through (half open): success closes the breaker, failure opens
+    it for another cooldown.
+    """
+
+    def __init__(self, failures=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN, trial_timeout=BREAKER_TRIAL_TIMEOUT):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.trial_timeout = trial_timeout
+        self.breakers = {}
+        self.lock = threading.Lock()
+
+    def _breaker(self, key):
+        breaker = self.breakers.get(key)
+        if breaker is None:
+            breaker = self.breakers[key] = {
+                "state": CLOSED,
+                "failures": 0,
+                "opened_at": None,
+                "trial_started_at": None,
+                "skipped": 0,
+            }
+        return breaker
+
+    def allow(self, key):
+        """True if a call for key may go ahead; an allowed half-open call is the trial"""
+        now = time.time()
+        with self.lock:
+            breaker = self._breaker(key)
+            if breaker['state'] == CLOSED:
+                return True
+
+            if breaker['state'] == OPEN and now - breaker['opened_at'] >= self.cooldown:
+                breaker['state'] = HALF_OPEN
+                breaker['trial_started_at'] = None
+
+            if breaker['state'] == HALF_OPEN:
+                trial_started_at = breaker['trial_started_at']
+                if trial_started_at is None or now - trial_started_at >= self.trial_timeout:
+                    breaker['trial_started_at'] = now
+                    return True
+
+            breaker['skipped'] += 1
+            return False
+
+    def record(self, key, success):
+        """Report the outcome of a call allowed for key"""
+        with self.lock:
+            breaker = self._breaker(key)
+            if success:
+                if breaker['state'] != CLOSED:
+                    logger.info(f"Circuit breaker {key} closed")
+                breaker.update(state=CLOSED, failures=0, opened_at=None, trial_started_at=None)
+                return
+
+            breaker['failures'] += 1
+            if breaker['state'] == HALF_OPEN or breaker['failures'] >= self.failures:
+                if breaker['state'] != OPEN:
+                    logger.warning(f"Circuit breaker {key} opened after {breaker['failures']} failures")
+                breaker.update(state=OPEN, opened_at=time.time(), trial_started_at=None)
+
+    def snapshot(self):
+        """Breakers that aren't closed, keyed 'domain/strategy'"""
+        now = time.time()
+        with self.lock:
+            return {
+                '/'.join(map(str, key)): {
+                    "state": breaker['state'],
+                    "failures": breaker['failures'],
+                    "reopens_in": max(round(breaker['opened_at'] + self.cooldown - now), 0)
+                    if breaker['state'] == OPEN else 0,
+                    "skipped": breaker['skipped'],
+                }
+                for key, breaker in self.breakers.items()
+                if breaker['state'] != CLOSED
+            }
@@ -0,0 +1,162 @@
+import os
+import time
+import threading
+import logging
+
+from utils.urls import PLATFORM_HOSTS, url_platform
+
+logger = logging.getLogger(__name__)
+
+# How long a jar is benched after a failure, by handle_download_error reason
+COOLDOWNS = {
+    'rate_limited': 15 * 60,
+    'login_required': 60 * 60,
+    'invalid_cookies': 60 * 60,
+}
+
+def load_cookie_jar(path):
+    """Parse a Netscape cookies file once into a yt-dlp cookie jar"""
+    from yt_dlp.cookies import YoutubeDLCookieJar
+
+    jar = YoutubeDLCookieJar(path)
+    jar.load(ignore_discard=True, ignore_expires=True)
+    return jar
+
+
+class CookiePool:
+    """
+    Parsed cookie jars from the cookies folder, rotated per platform.
+
+    Files are parsed once and re-read only when the folder changes (one stat
+    per request instead of a listdir) or after invalidate(). Healthy jars for
+    the URL's platform are handed out round-robin; a jar whose attempt failed
+    with a login or rate-limit error cools down for a while before reuse.
+    """
+
+    def __init__(self, cookies_folder):
+        self.cookies_folder = cookies_folder
+        self.jars = {}
+        self.cursors = {}
+        self.folder_mtime = None
+        self.lock = threading.Lock()
+
+    def invalidate(self, path=None):
+        """Force a reload on next use, re-parsing path if given (e.g. after an upload)"""
+        with self.lock:
+            self.folder_mtime = None
+            if path:
+                self.jars.pop(path, None)
+
+    def _refresh(self):
+        try:
+            mtime = os.stat(self.cookies_folder).st_mtime_ns
+        except OSError:
+            self.jars = {}
+            return
+
+        if mtime == self.folder_mtime:
+            return
+
+        jars = {}
+        for filename in sorted(os.listdir(self.cookies_folder)):
+            if not filename.endswith('.txt'):
+                continue
+            path = os.path.join(self.cookies_folder, filename)
+
+            # Keep parsed jars and their health for files we already know
+            if path in self.jars:
+                jars[path] = self.jars[path]
+                continue
+
+            entry = {
+                "path": path,
+                "jar": None,
+                "platforms": set(),
+                "cooldown_until": 0,
+                "successes": 0,
+                "failures": 0,
+                "last_error": None,
+            }
+            try:
+                entry['jar'] = load_cookie_jar(path)
+                cookie_domains = {cookie.domain.lstrip('.') for cookie in entry['jar']}
+                for platform, domains in PLATFORM_HOSTS.items():
+                    if any(d.endswith(domain) for d in cookie_domains for domain in domains) \
+                            or platform in filename.lower():
+                        entry['platforms'].add(platform)
+            except Exception as e:
+                logger.error(f"Could not parse cookies file {path}: {str(e)}")
+                entry['last_error'] = "Unparseable cookies file"
+            jars[path] = entry
+
+        self.jars = jars
+        self.folder_mtime = mtime
+        logger.info(f"Cookie pool loaded {len(jars)} cookie files")
+
+    def acquire(self, url):
+        """Return the next healthy jar entry for the URL's platform, or None"""
+        platform = url_platform(url)
+        now = time.time()
+
+        with self.lock:
+            self._refresh()
+
+            healthy = [
+                entry for entry in self.jars.values()
+                if entry['jar'] is not None and entry['cooldown_until'] <= now
+            ]
+            candidates = [entry for entry in healthy if platform in entry['platforms']] or healthy
+            if not candidates:
+                return None
+
+            cursor = self.cursors.get(platform, 0)
+            self.cursors[platform] = cursor + 1
+            return candidates[cursor % len(candidates)]
+
+    def report(self, path, success, reason=None):
+        """Record the outcome of an attempt that used the jar at path"""
+        with self.lock:
+            entry = self.jars.get(path)
+            if not entry:
+                return
+
+            if success:
+                entry['successes'] += 1
+                entry['cooldown_until'] = 0
+                return
+
+            entry['failures'] += 1
+            entry['last_error'] = reason
+            cooldown = COOLDOWNS.get(reason)
+            if cooldown:
+                entry['cooldown_until'] = time.time() + cooldown
+                logger.warning(f"Cookies {os.path.basename(path)} cooling down for {cooldown}s ({reason})")
+
+    def health(self):
+        now = time.time()
+        with self.lock:
+            self._refresh()
+            return [
+                {
+                    "file": os.path.basename(entry['path']),
+                    "platforms": sorted(entry['platforms']),
+                    "healthy": entry['jar'] is not None and entry['cooldown_until'] <= now,
+                    "cooldown_remaining": max(0, round(entry['cooldown_until'] - now)),
+                    "successes": entry['successes'],
+                    "failures": entry['failures'],
+                    "last_error": entry['last_error'],
+                }
+                for entry in self.jars.values()
+            ]
+
+
+pools = {}
+pools_lock = threading.Lock()
+
+
+def get_cookie_pool(cookies_folder):
+    """The shared pool for a cookies folder"""
+    with pools_lock:
+        if cookies_folder not in pools:
+            pools[cookies_folder] = CookiePool(cookies_folder)
+        return pools[cookies_folder]
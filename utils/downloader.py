@@ -2,96 +2,63 @@ import os
 import uuid
 import time
 import logging
-from urllib.parse import urlparse
+
+from utils.urls import url_platform, metric_platform
 
 logger = logging.getLogger(__name__)
 
-def download_reel_with_cookies(url, download_folder, cookies_folder):
+def download_reel_with_cookies(url, download_folder, cookies_folder, progress_callback=None):
     """
-    Download reel using cookies to bypass login requirements
+    Download reel, trying the cookie-based and public strategies in order of
+    their recorded success for this domain
     """
+    from utils.strategies import race_strategies, cookie_strategy, FALLBACK_STRATEGIES, strategy_stats
+    from utils.strategy_stats import url_domain
+    from utils.cookie_pool import get_cookie_pool
+    from utils.metrics import timed, STAGE_SECONDS
+    from utils.throttle import upstream_throttle, ThrottledError
+    
+    logger.info(f"Attempting download: {url}")
+    domain = url_domain(url)
+    platform = metric_platform(url)
+    
+    # Next healthy cookie jar for this platform, already parsed
+    with timed(STAGE_SECONDS, stage='cookies', domain=platform, strategy='cookies'):
+        cookie_pool = get_cookie_pool(cookies_folder)
+        cookies = cookie_pool.acquire(url)
+    cookies_file = cookies['path'] if cookies else None
+    
+    if cookies_file:
+        logger.info(f"Using cookies file: {cookies_file}")
+    else:
+        logger.info("No cookies file found, attempting without cookies")
+    
+    strategies = strategy_stats.order(domain, [cookie_strategy(cookies)] + FALLBACK_STRATEGIES)
+    hedge_delay = strategy_stats.hedge_delay(domain, strategies[0])
+    
+    logger.info(f"Strategy order for {domain}: {[s['name'] for s in strategies]}")
+    
     try:
-        import yt_dlp
-        
-        logger.info(f"Attempting download: {url}")
-        
-        filename = f"reel_{uuid.uuid4().hex}.mp4"
-        filepath = os.path.join(download_folder, filename)
-        
-        # Find available cookies files
-        cookies_file = find_best_cookies(cookies_folder, url)
-        
-        # Advanced yt-dlp configuration with cookie support
-        ydl_opts = build_ydl_options(filepath, cookies_file)
-        
+        # Each probe and the download take their own upstream slots
+        result = race_strategies(url, download_folder, strategies, progress_callback, hedge_delay=hedge_delay)
+    except ThrottledError as e:
+        return throttled_result(e)
+    upstream_throttle.report(url, () if result['success'] else result.get('errors', {}).values())
+    
+    cookie_error = result.get('errors', {}).get('cookies')
+    if cookie_error:
+        classified = handle_download_error(cookie_error, cookies_file)
         if cookies_file:
-            logger.info(f"Using cookies file: {cookies_file}")
-        else:
-            logger.info("No cookies file found, attempting without cookies")
-        
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            try:
-                # Extract info first
-                info = ydl.extract_info(url, download=False)
-                
-                if not info:
-                    return try_alternative_methods(url, download_folder)
-                
-                logger.info(f"Video info extracted: {info.get('title', 'Unknown')}")
-                
-                # Download the video
-                ydl.download([url])
-                
-                # Find the actual downloaded file
-                actual_filepath = find_downloaded_file(ydl.prepare_filename(info), download_folder)
-                
-                if not actual_filepath:
-                    return {
-                        "success": False,
-                        "error": "Downloaded file not found",
-                        "solution": "Try again or use different cookies"
-                    }
-                
-                # Rename to final filename
-                final_filepath = os.path.join(download_folder, filename)
-                if actual_filepath != final_filepath:
-                    if os.path.exists(final_filepath):
-                        os.remove(final_filepath)
-                    os.rename(actual_filepath, final_filepath)
-                
-                # Verify download
-                if os.path.exists(final_filepath) and os.path.getsize(final_filepath) > 1024:
-                    file_size = os.path.getsize(final_filepath)
-                    
-                    return {
-                        "success": True,
-                        "filename": filename,
-                        "filepath": final_filepath,
-                        "file_size": file_size,
-                        "title": clean_title(info.get('title', 'reel')),
-                        "duration": format_duration(info.get('duration')),
-                        "thumbnail": info.get('thumbnail'),
-                        "quality": info.get('format_note', 'HD'),
-                        "message": "Download completed successfully"
-                    }
-                else:
-                    return {
-                        "success": False,
-                        "error": "Downloaded file is empty or too small",
-                        "solution": "The content might be restricted or cookies expired"
-                    }
-                    
-            except yt_dlp.utils.DownloadError as e:
-                error_msg = str(e)
-                logger.error(f"DownloadError: {error_msg}")
-                
-                return handle_download_error(error_msg, cookies_file)
-                
-    except Exception as e:
-        logger.error(f"Unexpected error: {str(e)}")
-        return try_alternative_methods(url, download_folder)
+            cookie_pool.report(cookies_file, False, classified['reason'])
+        # Explain the failure using the cookie attempt's error
+        if not result['success'] and result.get('reason') != 'storage_full':
+            return classified
+    elif cookies_file and result.get('strategy') == 'cookies':
+        cookie_pool.report(cookies_file, True)
+    
+    return result
 
-def build_ydl_options(filepath, cookies_file):
+def build_ydl_options(url, filepath, cookies_file, progress_callback=None, proxy=None):
     """Build optimized yt-dlp options with cookie support"""
     
     # Default headers
@@ -119,7 +86,7 @@ def build_ydl_options(filepath, cookies_file):
         'retries': 10,
         'fragment_retries': 10,
         'skip_unavailable_fragments': True,
-        'continue_dl': True,
+        'continuedl': True,
         
         # Timeouts
         'socket_timeout': 30,
@@ -146,20 +113,24 @@ def build_ydl_options(filepath, cookies_file):
         'no_warnings': False,
         
         # Progress hooks
-        'progress_hooks': [lambda d: progress_hook(d)],
+        'progress_hooks': [lambda d: progress_hook(d, progress_callback)],
         
         # Post-processing - removed problematic options
         'postprocessors': [],
     }
     
+    if proxy:
+        ydl_opts['proxy'] = proxy
+    
     # Platform-specific optimizations
-    if 'instagram.com' in url:
+    platform = url_platform(url)
+    if platform == 'instagram':
         ydl_opts['http_headers'].update({
             'Referer': 'https://www.instagram.com/',
             'Origin': 'https://www.instagram.com',
             'X-IG-App-ID': '936619743392459',
         })
-    elif 'facebook.com' in url:
+    elif platform == 'facebook':
         ydl_opts['http_headers'].update({
             'Referer': 'https://www.facebook.com/',
             'Origin': 'https://www.facebook.com',
@@ -167,171 +138,9 @@ def build_ydl_options(filepath, cookies_file):
     
     return ydl_opts
 
-def try_alternative_methods(url, download_folder):
-    """Try alternative download methods when main method fails"""
-    logger.info("Trying alternative download methods...")
-    
-    # Method 1: Simple download without cookies
-    result = simple_download(url, download_folder)
-    if result['success']:
-        return result
-    
-    # Method 2: Try with different format selection
-    result = alternative_format_download(url, download_folder)
-    if result['success']:
-        return result
-    
-    # Method 3: Last resort - minimal configuration
-    result = minimal_download(url, download_folder)
-    if result['success']:
-        return result
-    
-    return {
-        "success": False,
-        "error": "All download methods failed",
-        "solution": "The reel might be private, geo-restricted, or unavailable. Try uploading cookies for private accounts."
-    }
-
-def simple_download(url, download_folder):
-    """Simple download method with minimal configuration"""
-    try:
-        import yt_dlp
-        
-        filename = f"reel_simple_{uuid.uuid4().hex}.mp4"
-        filepath = os.path.join(download_folder, filename)
-        
-        ydl_opts = {
-            'outtmpl': filepath,
-            'format': 'best[height<=720]',
-            'quiet': True,
-            'retries': 3,
-        }
-        
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-        
-        if os.path.exists(filepath) and os.path.getsize(filepath) > 0:
-            return {
-                "success": True,
-                "filename": filename,
-                "file_size": os.path.getsize(filepath),
-                "title": clean_title(info.get('title', 'reel')),
-                "duration": format_duration(info.get('duration')),
-            }
-        else:
-            return {"success": False}
-            
-    except Exception as e:
-        logger.error(f"Simple download failed: {str(e)}")
-        return {"success": False}
-
-def alternative_format_download(url, download_folder):
-    """Try with different format selection"""
-    try:
-        import yt_dlp
-        
-        filename = f"reel_alt_{uuid.uuid4().hex}.mp4"
-        filepath = os.path.join(download_folder, filename)
-        
-        # Try different format combinations
-        format_preferences = [
-            'best[ext=mp4]',
-            'worst[height>=240]',
-            'best[height<=480]',
-            'best'
-        ]
-        
-        for format_str in format_preferences:
-            try:
-                ydl_opts = {
-                    'outtmpl': filepath,
-                    'format': format_str,
-                    'quiet': True,
-                    'retries': 2,
-                }
-                
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    info = ydl.extract_info(url, download=True)
-                
-                if os.path.exists(filepath) and os.path.getsize(filepath) > 0:
-                    return {
-                        "success": True,
-                        "filename": filename,
-                        "file_size": os.path.getsize(filepath),
-                        "title": clean_title(info.get('title', 'reel')),
-                        "duration": format_duration(info.get('duration')),
-                    }
-                    
-            except Exception as e:
-                continue
-                
-        return {"success": False}
-        
-    except Exception as e:
-        return {"success": False}
-
-def minimal_download(url, download_folder):
-    """Minimal configuration download as last resort"""
-    try:
-        import yt_dlp
-        
-        filename = f"reel_min_{uuid.uuid4().hex}.mp4"
-        filepath = os.path.join(download_folder, filename)
-        
-        ydl_opts = {
-            'outtmpl': filepath,
-            'quiet': True,
-        }
-        
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-        
-        if os.path.exists(filepath) and os.path.getsize(filepath) > 0:
-            return {
-                "success": True,
-                "filename": filename,
-                "file_size": os.path.getsize(filepath),
-                "title": clean_title(info.get('title', 'reel')),
-            }
-        else:
-            return {"success": False}
-            
-    except Exception as e:
-        return {"success": False}
-
-def find_best_cookies(cookies_folder, url):
-    """Find the best cookies file for the given URL"""
-    try:
-        cookies_files = []
-        
-        # Look for cookies files
-        for file in os.listdir(cookies_folder):
-            if file.endswith('.txt'):
-                cookies_files.append(os.path.join(cookies_folder, file))
-        
-        if not cookies_files:
-            return None
-        
-        # Prioritize platform-specific cookies
-        if 'instagram.com' in url:
-            for cookie_file in cookies_files:
-                if 'instagram' in cookie_file.lower():
-                    return cookie_file
-        
-        elif 'facebook.com' in url:
-            for cookie_file in cookies_files:
-                if 'facebook' in cookie_file.lower():
-                    return cookie_file
-        
-        # Return the most recent cookies file
-        return max(cookies_files, key=os.path.getctime)
-        
-    except Exception as e:
-        logger.error(f"Error finding cookies: {str(e)}")
-        return None
-
 def handle_download_error(error_msg, cookies_file):
     """Handle specific download errors and provide solutions"""
+    from utils.throttle import is_rate_limited
     
     error_lower = error_msg.lower()
     
@@ -339,6 +148,7 @@ def handle_download_error(error_msg, cookies_file):
         return {
             "success": False,
             "error": "Login required - Private account or content",
+            "reason": "login_required",
             "solution": "Upload valid cookies file to download private reels"
         }
     
@@ -346,6 +156,7 @@ def handle_download_error(error_msg, cookies_file):
         return {
             "success": False,
             "error": "Age-restricted content",
+            "reason": "age_restricted",
             "solution": "Cannot download age-restricted content"
         }
     
@@ -353,6 +164,7 @@ def handle_download_error(error_msg, cookies_file):
         return {
             "success": False,
             "error": "Reel not found or has been removed",
+            "reason": "not_found",
             "solution": "Check the URL and try another reel"
         }
     
@@ -360,13 +172,15 @@ def handle_download_error(error_msg, cookies_file):
         return {
             "success": False,
             "error": "Invalid or expired cookies",
+            "reason": "invalid_cookies",
             "solution": "Upload fresh cookies file"
         }
     
-    elif 'rate limit' in error_lower:
+    elif is_rate_limited(error_msg):
         return {
             "success": False,
             "error": "Rate limit exceeded",
+            "reason": "rate_limited",
             "solution": "Wait a few minutes and try again"
         }
     
@@ -374,6 +188,7 @@ def handle_download_error(error_msg, cookies_file):
         return {
             "success": False,
             "error": "Configuration error",
+            "reason": "configuration",
             "solution": "Trying alternative download methods..."
         }
     
@@ -381,41 +196,22 @@ def handle_download_error(error_msg, cookies_file):
         return {
             "success": False,
             "error": f"Download failed: {error_msg}",
+            "reason": "unknown",
             "solution": "Trying alternative methods..."
         }
 
-def find_downloaded_file(temp_path, download_folder):
-    """Find the actual downloaded file"""
-    try:
-        # If temp file exists, return it
-        if os.path.exists(temp_path):
-            return temp_path
-        
-        # Look for files with similar base name
-        base_name = os.path.basename(temp_path).split('.')[0]
-        for file in os.listdir(download_folder):
-            if file.startswith(base_name):
-                return os.path.join(download_folder, file)
-        
-        # Look for recent video files
-        recent_files = []
-        for file in os.listdir(download_folder):
-            if file.endswith(('.mp4', '.webm', '.mkv', '.m4a')):
-                file_path = os.path.join(download_folder, file)
-                if time.time() - os.path.getmtime(file_path) < 300:
-                    recent_files.append(file_path)
-        
-        if recent_files:
-            return recent_files[0]
-        
-        return None
-        
-    except Exception as e:
-        logger.error(f"Error finding downloaded file: {str(e)}")
-        return None
+def throttled_result(error):
+    """Result for a download that got no upstream slot in time"""
+    return {
+        "success": False,
+        "error": "Too many downloads from this platform right now",
+        "reason": "rate_limited",
+        "solution": f"Try again in {error.retry_after} seconds",
+        "retry_after": error.retry_after,
+    }
 
-def progress_hook(d):
-    """Progress hook for downloads"""
+def progress_hook(d, callback=None):
+    """Progress hook for downloads, forwarding each update to callback if given"""
     try:
         if d['status'] == 'downloading':
             percent = d.get('_percent_str', 'Unknown')
@@ -423,6 +219,9 @@ def progress_hook(d):
             logger.info(f"Progress: {percent} at {speed}")
         elif d['status'] == 'finished':
             logger.info("Download finished")
+        
+        if callback:
+            callback(d)
     except Exception:
         pass
 
@@ -454,24 +253,41 @@ def clean_title(title):
     return title if title else 'reel'
 
 # Direct public download function
-def download_public_reel(url, download_folder):
+def download_public_reel(url, download_folder, progress_callback=None):
     """Direct public reel download without cookies"""
+    from utils.proxies import get_random_proxy, record_proxy_result
+    from utils.file_registry import discard_partial
+    from utils.storage import storage_manager, StorageFullError, DEFAULT_ESTIMATE
+    from utils.ydl_pool import ydl_pool, profile_key
+    from utils.throttle import upstream_throttle, ThrottledError
+    from utils.jobs import current_job_id
+    
+    proxy = get_random_proxy()
+    started = time.time()
+    # Named after the job, so a restarted job continues its .part file
+    filename = f"public_{current_job_id() or uuid.uuid4().hex}.mp4"
+    filepath = os.path.join(download_folder, filename)
+    
     try:
-        import yt_dlp
-        
-        filename = f"public_{uuid.uuid4().hex}.mp4"
-        filepath = os.path.join(download_folder, filename)
-        
         ydl_opts = {
             'outtmpl': filepath,
             'format': 'best[height<=720]',
             'quiet': True,
             'retries': 5,
             'socket_timeout': 30,
+            'continuedl': True,
         }
+        if proxy:
+            ydl_opts['proxy'] = proxy
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
+        hooks = [lambda d: progress_hook(d, progress_callback)]
+        # The size isn't known before extraction, so reserve a typical reel
+        with storage_manager.reserved(DEFAULT_ESTIMATE), upstream_throttle.slot(url):
+            with ydl_pool.borrow(profile_key('public', url, proxy), ydl_opts, outtmpl=filepath, progress_hooks=hooks) as ydl:
+                info = ydl.extract_info(url, download=True)
+        
+        record_proxy_result(proxy, started)
+        upstream_throttle.report(url)
         
         if os.path.exists(filepath) and os.path.getsize(filepath) > 0:
             return {
@@ -482,7 +298,85 @@ def download_public_reel(url, download_folder):
                 "duration": format_duration(info.get('duration')),
             }
         else:
+            discard_partial(filepath)
             return {"success": False, "error": "Download failed"}
             
+    except StorageFullError:
+        return {"success": False, "error": "Server storage is full", "reason": "storage_full"}
+    except ThrottledError as e:
+        return throttled_result(e)
+    except Exception as e:
+        record_proxy_result(proxy, started, e)
+        upstream_throttle.report(url, [str(e)])
+        discard_partial(filepath)
+        return {"success": False, "error": str(e), "reason": handle_download_error(str(e), None)['reason']}
+
+# Progressive (muxed audio + video) formats can be relayed byte-for-byte
+STREAMABLE_FORMAT = 'best[ext=mp4][acodec!=none][vcodec!=none]/best[acodec!=none][vcodec!=none]/best'
+
+def extract_reel_info(url, cookie_jar=None):
+    """Extract reel metadata, formats and direct CDN URLs without downloading"""
+    from utils.proxies import get_random_proxy, record_proxy_result
+    from utils.ydl_pool import ydl_pool, profile_key
+    from utils.throttle import upstream_throttle, ThrottledError
+    
+    proxy = get_random_proxy()
+    started = time.time()
+    
+    try:
+        ydl_opts = {
+            'format': STREAMABLE_FORMAT,
+            'quiet': True,
+            'socket_timeout': 30,
+        }
+        if proxy:
+            ydl_opts['proxy'] = proxy
+        
+        with upstream_throttle.slot(url):
+            with ydl_pool.borrow(profile_key('info', url, proxy, cookie_jar), ydl_opts, cookie_jar) as ydl:
+                info = ydl.extract_info(url, download=False)
+        
+        record_proxy_result(proxy, started)
+        upstream_throttle.report(url)
+        
+        if not info or not info.get('url'):
+            return {"success": False, "error": "No streamable format found"}
+        
+        formats = [
+            {
+                "format_id": f.get('format_id'),
+                "ext": f.get('ext'),
+                "width": f.get('width'),
+                "height": f.get('height'),
+                "vcodec": f.get('vcodec'),
+                "acodec": f.get('acodec'),
+                "filesize": f.get('filesize') or f.get('filesize_approx'),
+                "tbr": f.get('tbr'),
+                "url": f.get('url'),
+            }
+            for f in info.get('formats') or []
+            if f.get('url')
+        ]
+        
+        return {
+            "success": True,
+            "id": info.get('id'),
+            "title": clean_title(info.get('title', 'reel')),
+            "duration": format_duration(info.get('duration')),
+            "thumbnail": info.get('thumbnail'),
+            "uploader": info.get('uploader'),
+            "media_url": info['url'],
+            "http_headers": info.get('http_headers', {}),
+            "ext": info.get('ext', 'mp4'),
+            "filesize": info.get('filesize') or info.get('filesize_approx'),
+            "format_id": info.get('format_id'),
+            "formats": formats,
+        }
+        
+    except ThrottledError as e:
+        return throttled_result(e)
     except Exception as e:
+        record_proxy_result(proxy, started, e)
+        upstream_throttle.report(url, [str(e)])
+        logger.error(f"Info extraction failed: {str(e)}")
         return {"success": False, "error": str(e)}
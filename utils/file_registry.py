@@ -0,0 +1,379 @@
+import os
+import json
+import time
+import heapq
+import threading
+import logging
+
+try:
+    import fcntl
+except ImportError:  # Windows: one process per journal
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Leftovers yt-dlp writes next to the output file while downloading
+PARTIAL_SUFFIXES = ('.part', '.ytdl')
+
+
+def file_validators(path):
+    """(etag, last_modified) for HTTP caching, taken from the file's size and mtime"""
+    stat = os.stat(path)
+    return f"{stat.st_size:x}-{stat.st_mtime_ns:x}", int(stat.st_mtime)
+
+
+def discard_partial(filepath):
+    """Remove a failed download's output file and any partial pieces"""
+    for path in (filepath,) + tuple(filepath + suffix for suffix in PARTIAL_SUFFIXES):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class FileRegistry:
+    """
+    Index of the files the app produced in one folder.
+
+    Every file is registered by name with its owner job, size, expiry time
+    and HTTP validators (ETag and Last-Modified, computed once here rather
+    than on every request), so serving a file is a dict lookup and cleanup pops expired
+    entries off a heap instead of listing and stat-ing the folder. Files
+    nobody registered are never picked up, even if they are "recent".
+
+    With a ``journal_path`` every change is appended to a JSON-lines
+    journal that is replayed on startup, so files survive a restart with
+    their original owner and expiry. Workers may share one journal: appends
+    and compact_journal() are serialized with flock, and compaction folds
+    what is on disk, not this process's index.
+
+    With a shared ``state`` backend entries are mirrored there as well, so
+    workers sharing the folder can serve and expire each other's files.
+    """
+
+    def __init__(self, folder, default_ttl, journal_path=None, state=None):
+        self.folder = folder
+        self.default_ttl = default_ttl
+        self.journal_path = journal_path
+        self.state = state
+        self.entries = {}
+        self.heap = []
+        self.total_bytes = 0
+        self.listeners = []
+        self.journal = None
+        self.lock = threading.Lock()
+
+        if journal_path:
+            self._replay()
+
+    def register(self, filename, owner=None, size=None, ttl=None):
+        """Record a finished file; returns its entry"""
+        if size is None:
+            size = os.path.getsize(self.path(filename))
+        etag, last_modified = file_validators(self.path(filename))
+        now = time.time()
+        entry = {
+            "filename": filename,
+            "owner": owner,
+            "size": size,
+            "etag": etag,
+            "last_modified": last_modified,
+            "created_at": now,
+            "expires_at": now + (self.default_ttl if ttl is None else ttl),
+            "last_used_at": now,
+        }
+        with self.lock:
+            self._add(entry)
+            heapq.heappush(self.heap, (entry['expires_at'], filename))
+            self._write({"op": "add", **entry})
+        self._publish(entry)
+        return dict(entry)
+
+    def lookup(self, filename):
+        """Entry for filename, or None if it was never registered or is gone"""
+        with self.lock:
+            entry = self.entries.get(filename)
+            if entry and entry['expires_at'] > time.time():
+                return dict(entry)
+
+        # Registered by another worker, or kept alive by one
+        shared = self._shared(filename)
+        if shared and os.path.exists(self.path(filename)):
+            with self.lock:
+                if filename in self.entries:
+                    self.entries[filename]['expires_at'] = shared['expires_at']
+                else:
+                    self._add(shared)
+                    self._write({"op": "add", **shared})
+                heapq.heappush(self.heap, (shared['expires_at'], filename))
+                return dict(self.entries[filename])
+        return dict(entry) if entry else None
+
+    def touch(self, filename):
+        """Mark a file as just served, for least-recently-served eviction"""
+        with self.lock:
+            entry = self.entries.get(filename)
+            if entry:
+                entry['last_used_at'] = time.time()
+
+    def least_recently_used(self, min_age=0):
+        """Entries registered at least min_age seconds ago, least recently served first"""
+        cutoff = time.time() - min_age
+        with self.lock:
+            entries = [dict(entry) for entry in self.entries.values() if entry['created_at'] <= cutoff]
+        return sorted(entries, key=lambda entry: entry['last_used_at'])
+
+    def evictable_bytes(self, min_age=0):
+        """Total size of the entries least_recently_used(min_age) would return, without copying them"""
+        cutoff = time.time() - min_age
+        with self.lock:
+            return sum(entry['size'] for entry in self.entries.values() if entry['created_at'] <= cutoff)
+
+    def on_remove(self, listener):
+        """Call listener(filename) whenever a file leaves the registry"""
+        self.listeners.append(listener)
+
+    def set_expiry(self, filename, expires_at):
+        """Move a file's expiry, e.g. when the result cache extends its lifetime"""
+        with self.lock:
+            entry = self.entries.get(filename)
+            if not entry or entry['expires_at'] == expires_at:
+                return
+            entry['expires_at'] = expires_at
+            heapq.heappush(self.heap, (expires_at, filename))
+            self._write({"op": "expire", "filename": filename, "expires_at": expires_at})
+            self._compact_heap()
+            entry = dict(entry)
+        self._publish(entry)
+
+    def remove(self, filename, delete_file=True):
+        with self.lock:
+            removed = self._drop(filename, delete_file)
+        if removed:
+            self._notify([filename])
+
+    def expire(self, now=None):
+        """Delete every file whose expiry has passed; returns the number removed"""
+        now = time.time() if now is None else now
+        removed = []
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                expires_at, filename = heapq.heappop(self.heap)
+                entry = self.entries.get(filename)
+                # Stale heap item: the file was removed or its expiry moved
+                if not entry or entry['expires_at'] != expires_at:
+                    continue
+                shared = self._shared(filename)
+                if shared and shared['expires_at'] > now:
+                    # Another worker extended it
+                    entry['expires_at'] = shared['expires_at']
+                    heapq.heappush(self.heap, (entry['expires_at'], filename))
+                    continue
+                self._drop(filename, delete_file=True)
+                removed.append(filename)
+        self._notify(removed)
+        return len(removed)
+
+    def adopt(self, max_age, keep_partial=None):
+        """
+        Register files already in the folder that the registry doesn't know,
+        expiring them max_age after they were created. Run once at startup to
+        pick up files from before a restart without a journal. Partial
+        downloads are orphans and deleted, unless keep_partial(filename) says
+        a job that is about to resume will continue them.
+        """
+        adopted = 0
+        for entry in os.scandir(self.folder):
+            if not entry.is_file() or entry.name.startswith('.'):
+                continue
+            with self.lock:
+                known = entry.name in self.entries
+            if known:
+                continue
+            if entry.name.endswith(PARTIAL_SUFFIXES):
+                if not (keep_partial and keep_partial(entry.name)):
+                    discard_partial(entry.path)
+                continue
+
+            stat = entry.stat()
+            etag, last_modified = file_validators(entry.path)
+            with self.lock:
+                self._add({
+                    "filename": entry.name,
+                    "owner": None,
+                    "size": stat.st_size,
+                    "etag": etag,
+                    "last_modified": last_modified,
+                    "created_at": stat.st_ctime,
+                    "expires_at": stat.st_ctime + max_age,
+                    "last_used_at": stat.st_ctime,
+                })
+                heapq.heappush(self.heap, (stat.st_ctime + max_age, entry.name))
+                self._write({"op": "add", **self.entries[entry.name]})
+            adopted += 1
+        return adopted
+
+    def path(self, filename):
+        return os.path.join(self.folder, filename)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "files": len(self.entries),
+                "bytes": self.total_bytes,
+                "journal": bool(self.journal_path),
+            }
+
+    def _add(self, entry):
+        previous = self.entries.get(entry['filename'])
+        if previous:
+            self.total_bytes -= previous['size']
+        self.entries[entry['filename']] = entry
+        self.total_bytes += entry['size']
+
+    def _drop(self, filename, delete_file):
+        entry = self.entries.pop(filename, None)
+        if entry is None:
+            return False
+        self.total_bytes -= entry['size']
+        self._write({"op": "remove", "filename": filename})
+        if self.state:
+            try:
+                self.state.delete(f"file:{filename}")
+            except Exception as e:
+                logger.warning(f"Could not unpublish file {filename}: {str(e)}")
+        if delete_file:
+            try:
+                os.remove(self.path(filename))
+            except OSError:
+                pass
+        return True
+
+    def _publish(self, entry):
+        if not self.state:
+            return
+        try:
+            self.state.set(f"file:{entry['filename']}", entry, ttl=entry['expires_at'] - time.time())
+        except Exception as e:
+            logger.warning(f"Could not publish file {entry['filename']}: {str(e)}")
+
+    def _shared(self, filename):
+        if not self.state:
+            return None
+        try:
+            return self.state.get(f"file:{filename}")
+        except Exception as e:
+            logger.warning(f"Could not read file {filename} from shared state: {str(e)}")
+            return None
+
+    def _notify(self, filenames):
+        # Called without the lock held, so listeners may call back into the registry
+        for filename in filenames:
+            for listener in self.listeners:
+                try:
+                    listener(filename)
+                except Exception as e:
+                    logger.error(f"File registry listener error: {str(e)}")
+
+    def _compact_heap(self):
+        # Moved expiries leave stale heap items behind; rebuild once they dominate
+        if len(self.heap) > 2 * len(self.entries) + 64:
+            self.heap = [(entry['expires_at'], name) for name, entry in self.entries.items()]
+            heapq.heapify(self.heap)
+
+    def _write(self, record):
+        if not self.journal:
+            return
+        line = json.dumps(record) + '\n'
+        try:
+            while True:
+                if fcntl:
+                    fcntl.flock(self.journal, fcntl.LOCK_SH)
+                try:
+                    if not self._journal_replaced():
+                        self.journal.write(line)
+                        self.journal.flush()
+                        return
+                finally:
+                    if fcntl:
+                        fcntl.flock(self.journal, fcntl.LOCK_UN)
+                # Another process compacted it; append to the new file
+                self.journal.close()
+                self.journal = open(self.journal_path, 'a')
+        except OSError as e:
+            logger.warning(f"Could not write file journal: {str(e)}")
+
+    def _journal_replaced(self):
+        try:
+            return os.stat(self.journal_path).st_ino != os.fstat(self.journal.fileno()).st_ino
+        except FileNotFoundError:
+            return True
+
+    def compact_journal(self):
+        """
+        Replace the journal with one 'add' per file it still lists, dropping
+        files that are gone. Works from the journal on disk, so records other
+        workers appended are kept. Returns the entries, or None on error.
+        """
+        if not self.journal_path:
+            return None
+        try:
+            directory = os.path.dirname(self.journal_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.journal_path, 'a+') as f:
+                # Held until the new file is in place; appenders wait, then reopen
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                f.seek(0)
+                entries = self._fold(f)
+                tmp_path = f"{self.journal_path}.tmp"
+                with open(tmp_path, 'w') as tmp:
+                    for entry in entries.values():
+                        tmp.write(json.dumps({"op": "add", **entry}) + '\n')
+                os.replace(tmp_path, self.journal_path)
+        except OSError as e:
+            logger.warning(f"Could not compact file journal: {str(e)}")
+            return None
+        return entries
+
+    def _fold(self, lines):
+        """Live entries described by journal lines"""
+        entries = {}
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            op = record.pop('op', None)
+            if op == 'add':
+                record.setdefault('last_used_at', record['created_at'])
+                entries[record['filename']] = record
+            elif op == 'expire' and record['filename'] in entries:
+                entries[record['filename']]['expires_at'] = record['expires_at']
+            elif op == 'remove':
+                entries.pop(record['filename'], None)
+
+        # Drop entries whose file disappeared while we were down
+        entries = {name: entry for name, entry in entries.items() if os.path.exists(self.path(name))}
+        for name, entry in entries.items():
+            if 'etag' not in entry:
+                entry['etag'], entry['last_modified'] = file_validators(self.path(name))
+        return entries
+
+    def _replay(self):
+        """Rebuild the index from the journal, compacting it on the way"""
+        entries = self.compact_journal()
+        if entries is None:
+            logger.warning("File journal disabled")
+            return
+        self.entries = entries
+        self.total_bytes = sum(entry['size'] for entry in self.entries.values())
+        self.heap = [(entry['expires_at'], name) for name, entry in self.entries.items()]
+        heapq.heapify(self.heap)
+        try:
+            self.journal = open(self.journal_path, 'a')
+        except OSError as e:
+            logger.warning(f"File journal disabled: {str(e)}")
+            return
+        logger.info(f"File registry recovered {len(self.entries)} files from {self.journal_path}")
@@ -0,0 +1,54 @@
+import os
+import logging
+
+try:
+    import fcntl
+except ImportError:  # Windows: every process is its own host
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class HostLock:
+    """
+    An exclusive, non-blocking flock on a file, so that of all the worker
+    processes on a host only one runs host-wide chores. The OS releases the
+    lock when its holder exits, and the next acquire() elsewhere takes over.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+
+    def acquire(self):
+        """True if this process holds the lock, trying to take it if not"""
+        if self.fd is not None:
+            return True
+        if fcntl is None:
+            return True
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self.fd = fd
+        logger.info(f"Process {os.getpid()} runs the host-wide scheduler")
+        return True
+
+    def release(self):
+        if self.fd is None:
+            return
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+        self.fd = None
+
+    def held(self):
+        return self.fd is not None or fcntl is None
@@ -0,0 +1,390 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from utils.state import SQLiteConnection
+
+logger = logging.getLogger(__name__)
+
+# Job states
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_FINISHED = 'finished'
+JOB_FAILED = 'failed'
+
+# Shared job snapshots outlive the job by this long, and progress is
+# published at most this often
+JOB_STATE_TTL = 3600
+PROGRESS_PUBLISH_INTERVAL = 1.0
+
+
+# The job the current worker thread is running
+_current = threading.local()
+
+
+def current_job_id():
+    """Id of the job running on this thread, or None outside a job"""
+    return getattr(_current, 'job_id', None)
+
+
+class QueueFullError(Exception):
+    """Raised when every worker is busy and the waiting queue is full"""
+
+
+class JobJournal:
+    """
+    Job state transitions in a SQLite database (WAL mode), with the request
+    that started each job, so jobs can be restored after a restart.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.db = SQLiteConnection(path)
+        self.db.get().execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, state TEXT NOT NULL, job TEXT NOT NULL, request TEXT, updated_at REAL)"
+        )
+
+    def record(self, job, request=None):
+        """Store a job snapshot; request is only written when given"""
+        job = {key: value for key, value in job.items() if key != 'version'}
+        self.db.get().execute(
+            "INSERT INTO jobs (id, state, job, request, updated_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET state = excluded.state, job = excluded.job, "
+            "request = COALESCE(excluded.request, jobs.request), updated_at = excluded.updated_at",
+            (job['id'], job['state'], json.dumps(job), json.dumps(request) if request else None, time.time()),
+        )
+
+    def load(self):
+        """Every journalled (job, request, updated_at) triple"""
+        rows = self.db.get().execute("SELECT job, request, updated_at FROM jobs").fetchall()
+        return [
+            (json.loads(job), json.loads(request) if request else None, updated_at)
+            for job, request, updated_at in rows
+        ]
+
+    def claim(self, job_id, updated_at):
+        """
+        Take over a job last changed at updated_at. Of several processes that
+        loaded the same journal only the first succeeds; False for the rest.
+        """
+        cursor = self.db.get().execute(
+            "UPDATE jobs SET updated_at = ? WHERE id = ? AND updated_at = ?", (time.time(), job_id, updated_at)
+        )
+        return cursor.rowcount == 1
+
+    def prune(self, cutoff):
+        """Forget finished jobs last changed before cutoff"""
+        self.db.get().execute(
+            "DELETE FROM jobs WHERE state IN (?, ?) AND updated_at < ?", (JOB_FINISHED, JOB_FAILED, cutoff)
+        )
+
+
+class JobManager:
+    """
+    Run download jobs on a bounded thread pool.
+
+    At most ``max_workers`` jobs run at once and at most ``max_queued``
+    more may wait for a worker; anything beyond that is rejected with
+    QueueFullError so the caller can apply backpressure.
+
+    With a shared ``state`` backend every job's snapshot is published
+    there too, so any worker can answer a status poll for it.
+
+    With a ``journal`` every state change is made durable. After a restart
+    load() restores the journalled jobs and resume() runs the unfinished
+    ones again under their old ids (when several workers load the same
+    journal, whichever claims a job first runs it); drain() stops taking work on shutdown
+    and leaves jobs that haven't started in the journal for the next run.
+    """
+
+    def __init__(self, max_workers=4, max_queued=16, state=None, journal=None):
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.state = state
+        self.journal = journal
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='download-job')
+        self.slots = threading.BoundedSemaphore(max_workers + max_queued)
+        self.jobs = {}
+        self.futures = {}
+        self.published_at = {}
+        self.lock = threading.Lock()
+        # Per job, notified on every change; created when someone subscribes
+        self.watchers = {}
+        # Unfinished jobs restored by load(), waiting for resume()
+        self.interrupted = {}
+        self.draining = False
+
+    def submit(self, func, *args, **kwargs):
+        """Queue func(*args, progress_callback=..., **kwargs) and return the job id"""
+        if self.draining:
+            raise QueueFullError("Server is shutting down")
+        if not self.slots.acquire(blocking=False):
+            raise QueueFullError("Download queue is full")
+
+        job_id = uuid.uuid4().hex
+        job = {
+            "id": job_id,
+            "state": JOB_QUEUED,
+            "progress": {},
+            "result": None,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "version": 0,
+        }
+        self._start(job, func, args, kwargs)
+        return job_id
+
+    def _start(self, job, func, args, kwargs):
+        """Queue a job that already holds a slot"""
+        job_id = job['id']
+        with self.lock:
+            self.jobs[job_id] = job
+        self._publish(job_id, dict(job))
+        self._journal(job, {"func": func.__name__, "args": list(args), "kwargs": kwargs})
+
+        try:
+            future = self.executor.submit(self._run, job_id, func, args, kwargs)
+        except Exception:
+            with self.lock:
+                self.jobs.pop(job_id, None)
+            self.slots.release()
+            raise
+
+        with self.lock:
+            if not future.done():
+                self.futures[job_id] = future
+
+    def _run(self, job_id, func, args, kwargs):
+        """Execute a job and record its outcome"""
+        self._update(job_id, state=JOB_RUNNING, started_at=time.time())
+        _current.job_id = job_id
+
+        try:
+            result = func(*args, progress_callback=lambda d: self.update_progress(job_id, d), **kwargs)
+        except Exception as e:
+            logger.error(f"Job {job_id} crashed: {str(e)}")
+            result = {"success": False, "error": "Internal server error"}
+        finally:
+            _current.job_id = None
+            self.slots.release()
+
+        state = JOB_FINISHED if result.get('success') else JOB_FAILED
+        self._update(job_id, state=state, result=result, finished_at=time.time())
+        with self.lock:
+            self.futures.pop(job_id, None)
+
+    def _update(self, job_id, publish=True, **fields):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if not job:
+                return
+            job.update(fields)
+            job['version'] += 1
+            watcher = self.watchers.get(job_id)
+            if watcher:
+                watcher.notify_all()
+            snapshot = dict(job) if publish or 'state' in fields else None
+        if publish:
+            self._publish(job_id, snapshot)
+        if 'state' in fields:
+            self._journal(snapshot)
+
+    def _journal(self, job, request=None):
+        if not self.journal:
+            return
+        try:
+            self.journal.record(job, request)
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            logger.warning(f"Could not journal job {job['id']}: {str(e)}")
+
+    def _claim(self, job_id, updated_at):
+        try:
+            return self.journal.claim(job_id, updated_at)
+        except sqlite3.Error as e:
+            logger.warning(f"Could not claim job {job_id}: {str(e)}")
+            return False
+
+    def load(self, max_age):
+        """
+        Restore journalled jobs: finished ones younger than max_age seconds
+        answer status polls again, unfinished ones wait for resume().
+        Returns the ids of the unfinished jobs.
+        """
+        if not self.journal:
+            return set()
+
+        cutoff = time.time() - max_age
+        try:
+            records = self.journal.load()
+        except sqlite3.Error as e:
+            logger.warning(f"Could not read job journal: {str(e)}")
+            return set()
+
+        with self.lock:
+            for job, request, updated_at in records:
+                job['version'] = 0
+                if job['state'] in (JOB_QUEUED, JOB_RUNNING):
+                    self.jobs[job['id']] = job
+                    self.interrupted[job['id']] = (request, updated_at)
+                elif job['finished_at'] and job['finished_at'] >= cutoff:
+                    self.jobs[job['id']] = job
+            interrupted = set(self.interrupted)
+
+        logger.info(f"Restored {len(records)} journalled jobs, {len(interrupted)} to resume")
+        return interrupted
+
+    def resume(self, handlers):
+        """
+        Run the jobs interrupted by the last shutdown again, under their old
+        ids. handlers maps the journalled function names to functions; jobs
+        that can't be resumed (unknown function, queue full) fail, and jobs
+        another process claimed first are left to it.
+        """
+        with self.lock:
+            interrupted, self.interrupted = self.interrupted, {}
+
+        resumed = 0
+        for job_id, (request, updated_at) in interrupted.items():
+            if not self._claim(job_id, updated_at):
+                # Its status now comes from the process running it
+                with self.lock:
+                    self.jobs.pop(job_id, None)
+                continue
+
+            with self.lock:
+                job = self.jobs[job_id]
+            func = handlers.get(request['func']) if request else None
+
+            if func is None or not self.slots.acquire(blocking=False):
+                self._update(job_id, state=JOB_FAILED, finished_at=time.time(), result={
+                    "success": False,
+                    "error": "Download was interrupted by a server restart",
+                    "solution": "Try again",
+                })
+                continue
+
+            job.update(state=JOB_QUEUED, progress={}, started_at=None)
+            self._start(job, func, request['args'], request['kwargs'])
+            resumed += 1
+
+        if interrupted:
+            logger.info(f"Resumed {resumed} of {len(interrupted)} interrupted jobs")
+        return resumed
+
+    def drain(self, timeout=0):
+        """
+        Stop accepting jobs and cancel the queued ones (the journal keeps
+        them for the next start), then wait up to timeout seconds for the
+        running ones. Returns the number of jobs still running.
+        """
+        with self.lock:
+            self.draining = True
+            futures = dict(self.futures)
+
+        cancelled = 0
+        for future in futures.values():
+            if future.cancel():
+                self.slots.release()
+                cancelled += 1
+
+        running = [future for future in futures.values() if not future.cancelled()]
+        if running and timeout > 0:
+            _, running = wait(running, timeout=timeout)
+
+        logger.info(f"Draining jobs: {cancelled} queued left for the next start, {len(running)} still running")
+        return len(running)
+
+    def _publish(self, job_id, snapshot):
+        if not self.state:
+            return
+        self.published_at[job_id] = time.time()
+        try:
+            self.state.set(f"job:{job_id}", snapshot, ttl=JOB_STATE_TTL)
+        except Exception as e:
+            logger.warning(f"Could not publish job {job_id}: {str(e)}")
+
+    def update_progress(self, job_id, d):
+        """Store the interesting parts of a yt-dlp progress dict on the job"""
+        downloaded = d.get('downloaded_bytes') or 0
+        total = d.get('total_bytes') or d.get('total_bytes_estimate') or 0
+
+        progress = {
+            "status": d.get('status'),
+            "downloaded_bytes": downloaded,
+            "total_bytes": total,
+            "percent": round(downloaded * 100.0 / total, 1) if total else None,
+            "speed": d.get('speed'),
+            "eta": d.get('eta'),
+        }
+        if d.get('status') == 'finished':
+            progress['percent'] = 100.0
+
+        # Progress ticks many times a second; the shared copy can lag a little
+        due = (
+            d.get('status') == 'finished'
+            or time.time() - self.published_at.get(job_id, 0) >= PROGRESS_PUBLISH_INTERVAL
+        )
+        self._update(job_id, publish=due, progress=progress)
+
+    def get(self, job_id):
+        """Return a snapshot of the job or None; jobs run by other workers come from the shared state"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job:
+                return dict(job)
+        if self.state:
+            try:
+                return self.state.get(f"job:{job_id}")
+            except Exception as e:
+                logger.warning(f"Could not read job {job_id} from shared state: {str(e)}")
+        return None
+
+    def wait_for_change(self, job_id, version, timeout):
+        """
+        Block until the job's version differs from version or timeout passes;
+        returns (snapshot, version). Jobs this process isn't running can't
+        be waited on: their shared snapshot comes back at once with version None.
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job:
+                watcher = self.watchers.setdefault(job_id, threading.Condition(self.lock))
+                watcher.wait_for(lambda: job['version'] != version, timeout)
+                return dict(job), job['version']
+        return self.get(job_id), None
+
+    def stats(self):
+        """Return counts of jobs per state"""
+        counts = {JOB_QUEUED: 0, JOB_RUNNING: 0, JOB_FINISHED: 0, JOB_FAILED: 0}
+        with self.lock:
+            for job in self.jobs.values():
+                counts[job['state']] += 1
+        counts['max_workers'] = self.max_workers
+        counts['max_queued'] = self.max_queued
+        return counts
+
+    def cleanup(self, max_age, prune_journal=True):
+        """Forget finished jobs older than max_age seconds"""
+        cutoff = time.time() - max_age
+        with self.lock:
+            expired = [
+                job_id for job_id, job in self.jobs.items()
+                if job['finished_at'] and job['finished_at'] < cutoff
+            ]
+            for job_id in expired:
+                del self.jobs[job_id]
+                self.futures.pop(job_id, None)
+                self.published_at.pop(job_id, None)
+                self.watchers.pop(job_id, None)
+        if self.journal and prune_journal:
+            try:
+                self.journal.prune(cutoff)
+            except sqlite3.Error as e:
+                logger.warning(f"Could not prune job journal: {str(e)}")
+        return len(expired)
@@ -0,0 +1,162 @@
+import time
+import threading
+from contextlib import contextmanager
+
+# Histogram buckets in seconds, from a cache hit to a slow download
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class Metric:
+    """Base for labelled metrics rendered in the Prometheus text format"""
+
+    type_name = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value):
+        return [f"{self.name}{format_labels(self.labelnames, key)} {value}"]
+
+
+class Counter(Metric):
+    type_name = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """A gauge that is either set directly or read from a callback at render time"""
+
+    type_name = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+    def render(self):
+        if self.callback:
+            for labels, value in self.callback():
+                self.set(value, **labels)
+        return super().render()
+
+
+class Histogram(Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry['counts'][i] += 1
+            entry['sum'] += value
+            entry['count'] += 1
+
+    def _render_value(self, key, entry):
+        lines = []
+        names = self.labelnames + ('le',)
+        for bound, count in zip(self.buckets, entry['counts']):
+            lines.append(f"{self.name}_bucket{format_labels(names, key + (bound,))} {count}")
+        lines.append(f"{self.name}_bucket{format_labels(names, key + ('+Inf',))} {entry['count']}")
+        lines.append(f"{self.name}_sum{format_labels(self.labelnames, key)} {entry['sum']}")
+        lines.append(f"{self.name}_count{format_labels(self.labelnames, key)} {entry['count']}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def counter(name, documentation, labelnames=()):
+    return registry.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name, documentation, labelnames=(), callback=None):
+    return registry.register(Gauge(name, documentation, labelnames, callback))
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return registry.register(Histogram(name, documentation, labelnames, buckets))
+
+
+@contextmanager
+def timed(metric, **labels):
+    """Observe the duration of the with-block on a histogram"""
+    started = time.time()
+    try:
+        yield
+    finally:
+        metric.observe(time.time() - started, **labels)
+
+
+# Metrics shared across the download path
+STAGE_SECONDS = histogram(
+    'reels_stage_seconds',
+    'Time spent in each stage of a request',
+    ('stage', 'domain', 'strategy'),
+)
+DOWNLOADS = counter('reels_downloads_total', 'Finished download jobs', ('domain', 'outcome'))
+STRATEGY_ATTEMPTS = counter(
+    'reels_strategy_attempts_total',
+    'Strategy probe outcomes',
+    ('domain', 'strategy', 'outcome'),
+)
+CACHE_REQUESTS = counter('reels_cache_requests_total', 'Cache lookups', ('cache', 'result'))
+BYTES_SERVED = counter('reels_bytes_served_total', 'Media bytes sent to clients', ('endpoint',))
+CLEANUP_DELETED = counter('reels_cleanup_deleted_total', 'Files deleted by cleanup')
@@ -1,38 +1,235 @@
+import os
+import time
 import requests
 import random
+import threading
 import logging
 
+from utils.throttle import is_rate_limited
+
 logger = logging.getLogger(__name__)
 
+PROXY_CHECK_URL = os.environ.get('PROXY_CHECK_URL', 'https://www.instagram.com/robots.txt')
+PROXY_CHECK_INTERVAL = int(os.environ.get('PROXY_CHECK_INTERVAL', 120))
+PROXY_CHECK_TIMEOUT = 10
+ALPHA = 0.3  # weight of the newest sample in the moving averages
+MAX_CONSECUTIVE_FAILURES = 3  # a proxy is benched after this many failures in a row
+
+# Error fragments that mean the egress path failed, not the reel; being
+# rate limited (matched by is_rate_limited) counts too
+NETWORK_ERROR_HINTS = (
+    'timed out', 'timeout', 'connection', 'proxy', 'tunnel', 'network is unreachable', 'ssl',
+)
+
+
+def is_network_error(error_msg):
+    """True if an error looks like the proxy's fault rather than the content's"""
+    error_lower = str(error_msg).lower()
+    return any(hint in error_lower for hint in NETWORK_ERROR_HINTS) or is_rate_limited(error_msg)
+
+
+def mask_proxy(proxy):
+    """Proxy URL with any credentials removed, safe for logs and status output"""
+    scheme, sep, rest = proxy.rpartition('://')
+    return f"{scheme}{sep}{rest.rpartition('@')[2]}"
+
+
+def parse_proxy_list(text):
+    """Proxies separated by commas or newlines; '#' starts a comment"""
+    proxies = []
+    for line in text.replace(',', '\n').splitlines():
+        line = line.split('#')[0].strip()
+        if line:
+            proxies.append(line)
+    return proxies
+
+
+class ProxyPool:
+    """
+    Outbound proxies with health checks and latency-weighted selection.
+
+    Every proxy keeps a moving average of latency and success rate, fed by
+    background health checks and by real downloads via report(). select()
+    picks at random, weighted by success rate / latency, among proxies that
+    haven't failed MAX_CONSECUTIVE_FAILURES times in a row.
+    """
+
+    def __init__(self, proxies=None, check_url=PROXY_CHECK_URL, check_interval=PROXY_CHECK_INTERVAL):
+        self.check_url = check_url
+        self.check_interval = check_interval
+        self.proxies = {}
+        self.lock = threading.Lock()
+        self.checker = None
+        self.set_proxies(proxies or [])
+
+    @classmethod
+    def from_env(cls):
+        """Load proxies from PROXY_LIST, PROXY_FILE and PROXY_SERVICE_URL"""
+        proxies = parse_proxy_list(os.environ.get('PROXY_LIST', ''))
+
+        proxy_file = os.environ.get('PROXY_FILE')
+        if proxy_file:
+            try:
+                with open(proxy_file) as f:
+                    proxies += parse_proxy_list(f.read())
+            except OSError as e:
+                logger.warning(f"Could not read proxy file: {str(e)}")
+
+        proxies += get_proxy_from_service()
+        return cls(proxies)
+
+    def set_proxies(self, proxies):
+        """Replace the proxy list, keeping stats for proxies already known"""
+        with self.lock:
+            self.proxies = {
+                proxy: self.proxies.get(proxy) or {
+                    "latency": None,
+                    "success_rate": 1.0,
+                    "consecutive_failures": 0,
+                    "requests": 0,
+                    "failures": 0,
+                    "last_checked": None,
+                }
+                for proxy in dict.fromkeys(proxies)
+            }
+
+    def select(self):
+        """Pick a proxy weighted by recent performance, or None to go direct"""
+        with self.lock:
+            if not self.proxies:
+                return None
+
+            healthy = {
+                proxy: stats for proxy, stats in self.proxies.items()
+                if stats['consecutive_failures'] < MAX_CONSECUTIVE_FAILURES
+            }
+            # If everything is benched, still try the least-bad ones
+            candidates = healthy or self.proxies
+
+            proxies = list(candidates)
+            weights = [self._weight(candidates[proxy]) for proxy in proxies]
+            return random.choices(proxies, weights=weights)[0]
+
+    @staticmethod
+    def _weight(stats):
+        latency = stats['latency'] if stats['latency'] is not None else 1.0
+        return max(stats['success_rate'], 0.01) / max(latency, 0.05)
+
+    def report(self, proxy, success, latency=None):
+        """Feed the outcome of a request made through proxy back into its stats"""
+        with self.lock:
+            stats = self.proxies.get(proxy)
+            if not stats:
+                return
+
+            stats['requests'] += 1
+            stats['success_rate'] += ALPHA * ((1.0 if success else 0.0) - stats['success_rate'])
+            if success:
+                stats['consecutive_failures'] = 0
+                if latency is not None:
+                    if stats['latency'] is None:
+                        stats['latency'] = latency
+                    else:
+                        stats['latency'] += ALPHA * (latency - stats['latency'])
+            else:
+                stats['failures'] += 1
+                stats['consecutive_failures'] += 1
+
+    def check(self, proxy):
+        """Fetch check_url through proxy and record the result"""
+        start_time = time.time()
+        try:
+            response = requests.get(
+                self.check_url,
+                proxies={'http': proxy, 'https': proxy},
+                timeout=PROXY_CHECK_TIMEOUT,
+            )
+            success = response.status_code < 500 and response.status_code != 429
+        except requests.RequestException as e:
+            logger.info(f"Proxy check failed for {mask_proxy(proxy)}: {str(e)}")
+            success = False
+
+        self.report(proxy, success, time.time() - start_time)
+        with self.lock:
+            if proxy in self.proxies:
+                self.proxies[proxy]['last_checked'] = time.time()
+        return success
+
+    def check_all(self):
+        with self.lock:
+            proxies = list(self.proxies)
+        return {proxy: self.check(proxy) for proxy in proxies}
+
+    def start_health_checks(self):
+        """Check every proxy now and then every check_interval seconds in the background"""
+        if self.checker or not self.proxies:
+            return
+
+        def run():
+            while True:
+                try:
+                    self.check_all()
+                except Exception as e:
+                    logger.error(f"Proxy health check error: {str(e)}")
+                time.sleep(self.check_interval)
+
+        self.checker = threading.Thread(target=run, daemon=True, name='proxy-health')
+        self.checker.start()
+
+    def health(self):
+        with self.lock:
+            return {
+                mask_proxy(proxy): {
+                    "healthy": stats['consecutive_failures'] < MAX_CONSECUTIVE_FAILURES,
+                    "latency": round(stats['latency'], 3) if stats['latency'] is not None else None,
+                    "success_rate": round(stats['success_rate'], 3),
+                    "requests": stats['requests'],
+                    "failures": stats['failures'],
+                    "last_checked": stats['last_checked'],
+                }
+                for proxy, stats in self.proxies.items()
+            }
+
+
 def get_random_proxy():
     """
-    Get random proxy from free proxy sources
-    Note: Free proxies are unreliable, consider paid proxies for production
+    Get a proxy from the pool, weighted by recent performance.
+    Returns None (connect directly) when no proxies are configured.
     """
     try:
-        # Free proxy list (you should replace with your own proxy service)
-        free_proxies = [
-            # Add some free proxies here, but they change frequently
-            # 'http://proxy1:port',
-            # 'http://proxy2:port',
-        ]
-        
-        if free_proxies:
-            return random.choice(free_proxies)
-        else:
-            return None
-            
+        return proxy_pool.select()
     except Exception as e:
         logger.warning(f"Proxy error: {str(e)}")
         return None
 
 def get_proxy_from_service():
     """
-    Get proxy from paid proxy service (implement based on your proxy provider)
+    Get proxies from a paid proxy service (Bright Data, Oxylabs, Smartproxy, ...)
+    that publishes its endpoint list at PROXY_SERVICE_URL, one per line
+    """
+    service_url = os.environ.get('PROXY_SERVICE_URL')
+    if not service_url:
+        return []
+
+    try:
+        response = requests.get(service_url, timeout=PROXY_CHECK_TIMEOUT)
+        response.raise_for_status()
+        return parse_proxy_list(response.text)
+    except requests.RequestException as e:
+        logger.warning(f"Could not load proxies from service: {str(e)}")
+        return []
+
+def record_proxy_result(proxy, started, error=None):
+    """
+    Report a download attempt made through proxy. Errors about the content
+    itself (private, removed...) still prove the proxy works.
     """
-    # Implementation for paid proxy services like:
-    # - Bright Data
-    # - Oxylabs
-    # - Smartproxy
-    # etc.
-    pass
+    if not proxy:
+        return
+    if error is not None and is_network_error(error):
+        proxy_pool.report(proxy, False)
+    else:
+        proxy_pool.report(proxy, True, time.time() - started if error is None else None)
+
+
+proxy_pool = ProxyPool.from_env()
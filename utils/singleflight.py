@@ -0,0 +1,110 @@
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class FlightTimeoutError(Exception):
+    """Raised when a follower gives up waiting for the leader's result"""
+
+
+class SingleFlight:
+    """
+    Collapse concurrent calls that share a key into a single execution.
+
+    The first caller for a key (the leader) runs the function; callers that
+    arrive while it is running wait for and share its result or exception.
+    A flight that has been running for longer than ``stale_after`` seconds
+    is no longer joined, so a hung leader can't block a key forever.
+    With do_with_progress() followers also see the leader's progress.
+    """
+
+    def __init__(self, stale_after=300):
+        self.stale_after = stale_after
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, func, *args, timeout=None, **kwargs):
+        """Return (result, shared) where shared is True for followers"""
+        return self._do(key, func, args, kwargs, timeout)
+
+    def do_with_progress(self, key, func, *args, progress_callback=None, timeout=None, **kwargs):
+        """
+        do() for a func taking a progress_callback: the leader's progress
+        updates go to every caller's progress_callback, and a follower gets
+        the latest one as it joins
+        """
+        return self._do(key, func, args, kwargs, timeout, progress_callback, with_progress=True)
+
+    def _do(self, key, func, args, kwargs, timeout, progress_callback=None, with_progress=False):
+        with self.lock:
+            call = self.calls.get(key)
+            if call and time.time() - call['started_at'] > self.stale_after:
+                logger.warning(f"Abandoning stale flight for {key}")
+                call = None
+
+            leader = call is None
+            if leader:
+                call = {
+                    "event": threading.Event(),
+                    "result": None,
+                    "error": None,
+                    "followers": 0,
+                    "started_at": time.time(),
+                    "listeners": [],
+                    "last_progress": None,
+                }
+                self.calls[key] = call
+            else:
+                call['followers'] += 1
+            if progress_callback:
+                call['listeners'].append(progress_callback)
+            last_progress = call['last_progress']
+
+        if leader:
+            if with_progress:
+                kwargs = dict(kwargs, progress_callback=lambda d: self._progress(call, d))
+            return self._lead(key, call, func, args, kwargs), False
+
+        if progress_callback and last_progress is not None:
+            self._notify(progress_callback, last_progress)
+
+        if not call['event'].wait(timeout):
+            raise FlightTimeoutError(f"Timed out waiting for {key}")
+        if call['error'] is not None:
+            raise call['error']
+        return call['result'], True
+
+    def _lead(self, key, call, func, args, kwargs):
+        try:
+            call['result'] = func(*args, **kwargs)
+            return call['result']
+        except BaseException as e:
+            call['error'] = e
+            raise
+        finally:
+            with self.lock:
+                if self.calls.get(key) is call:
+                    del self.calls[key]
+            if call['followers']:
+                logger.info(f"Shared result for {key} with {call['followers']} waiting requests")
+            call['event'].set()
+
+    def _progress(self, call, d):
+        with self.lock:
+            call['last_progress'] = d
+            listeners = list(call['listeners'])
+        for listener in listeners:
+            self._notify(listener, d)
+
+    @staticmethod
+    def _notify(listener, d):
+        try:
+            listener(d)
+        except Exception as e:
+            logger.error(f"Progress listener error: {str(e)}")
+
+    def in_flight(self):
+        with self.lock:
+            return len(self.calls)
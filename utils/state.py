@@ -0,0 +1,257 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+import logging
+from urllib.parse import urlparse
+
+from limits.storage import Storage
+
+logger = logging.getLogger(__name__)
+
+
+class StateBackend:
+    """
+    Key/value store shared by every worker and instance of the app.
+
+    Values are JSON-serialisable; keys may expire after ``ttl`` seconds.
+    Jobs, the result cache index and the file registry mirror their entries
+    here so a request can be answered by any worker, and Flask-Limiter keeps
+    its counters here via ``limiter_uri``.
+    """
+
+    limiter_uri = None
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def incr(self, key, amount=1, ttl=None):
+        """Add amount to an integer counter, starting its ttl when it's created; returns the new value"""
+        raise NotImplementedError
+
+    def expires_at(self, key):
+        """Unix time key expires, or None if it doesn't exist or never expires"""
+        raise NotImplementedError
+
+    def purge_expired(self):
+        """Drop expired keys; backends that expire keys themselves do nothing"""
+        return 0
+
+
+class SQLiteConnection:
+    """
+    Per-thread connections to a SQLite database in WAL mode. sqlite3
+    connections can't be shared between threads, and a forked worker must
+    not use its parent's, so each thread of each process opens its own.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        os.register_at_fork(after_in_child=self._reset)
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def get(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def _reset(self):
+        self.local = threading.local()
+
+
+class SQLiteBackend(StateBackend):
+    """
+    State in a SQLite database in WAL mode. Shared by all workers on one
+    host, or by instances that mount the same volume; good for tests and
+    single-machine deployments.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.limiter_uri = f"sqlite:///{os.path.abspath(path)}"
+        self.db = SQLiteConnection(path)
+        with self.db.get() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS state ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS state_expires_at ON state (expires_at)")
+
+    def get(self, key):
+        row = self.db.get().execute(
+            "SELECT value FROM state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (key, time.time()),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + ttl if ttl is not None else None
+        self.db.get().execute(
+            "INSERT OR REPLACE INTO state (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value), expires_at),
+        )
+
+    def delete(self, key):
+        self.db.get().execute("DELETE FROM state WHERE key = ?", (key,))
+
+    def delete_prefix(self, prefix):
+        cursor = self.db.get().execute(
+            "DELETE FROM state WHERE key >= ? AND key < ?", (prefix, prefix + '￿')
+        )
+        return cursor.rowcount
+
+    def incr(self, key, amount=1, ttl=None):
+        now = time.time()
+        conn = self.db.get()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT value, expires_at FROM state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (key, now),
+            ).fetchone()
+            if row:
+                value = int(row[0]) + amount
+                expires_at = row[1]
+            else:
+                value = amount
+                expires_at = now + ttl if ttl is not None else None
+            conn.execute(
+                "INSERT OR REPLACE INTO state (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, str(value), expires_at),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return value
+
+    def expires_at(self, key):
+        row = self.db.get().execute(
+            "SELECT expires_at FROM state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (key, time.time()),
+        ).fetchone()
+        return row[0] if row else None
+
+    def purge_expired(self):
+        cursor = self.db.get().execute("DELETE FROM state WHERE expires_at <= ?", (time.time(),))
+        return cursor.rowcount
+
+
+class RedisBackend(StateBackend):
+    """State in Redis (or anything speaking its protocol), for several instances"""
+
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("STATE_BACKEND_URL points at Redis but the 'redis' package isn't installed")
+
+        self.client = redis.Redis.from_url(url)
+        self.limiter_uri = url
+
+    def get(self, key):
+        value = self.client.get(key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl=None):
+        self.client.set(key, json.dumps(value), ex=max(int(ttl), 1) if ttl is not None else None)
+
+    def delete(self, key):
+        self.client.delete(key)
+
+    def incr(self, key, amount=1, ttl=None):
+        # SET NX starts the window; EXPIRE ... NX would need Redis 7
+        pipe = self.client.pipeline()
+        if ttl is not None:
+            pipe.set(key, 0, ex=max(int(ttl), 1), nx=True)
+        pipe.incrby(key, amount)
+        return pipe.execute()[-1]
+
+    def expires_at(self, key):
+        remaining = self.client.pttl(key)
+        return time.time() + remaining / 1000.0 if remaining > 0 else None
+
+
+def sqlite_path(url):
+    """
+    Database path of a sqlite:// URL, read like SQLAlchemy does:
+    sqlite:///data/state.db is relative to the working directory,
+    sqlite:////var/lib/state.db is absolute
+    """
+    path = urlparse(url).path[1:]
+    if not path:
+        raise ValueError(f"No database path in {url}")
+    return path
+
+
+class SQLiteLimitStorage(Storage):
+    """
+    Flask-Limiter storage for ``sqlite:///path`` URIs (fixed window only),
+    so rate limits are shared by all workers using the same database.
+    Registered with the limits library by STORAGE_SCHEME.
+    """
+
+    STORAGE_SCHEME = ["sqlite"]
+
+    def __init__(self, uri=None, wrap_exceptions=False, **options):
+        self.backend = SQLiteBackend(sqlite_path(uri))
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def incr(self, key, expiry, amount=1, elastic_expiry=False):
+        return self.backend.incr(f"limit:{key}", amount, expiry)
+
+    def get(self, key):
+        return int(self.backend.get(f"limit:{key}") or 0)
+
+    def get_expiry(self, key):
+        return self.backend.expires_at(f"limit:{key}") or time.time()
+
+    def check(self):
+        try:
+            self.backend.get("limit:__check__")
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self):
+        return self.backend.delete_prefix("limit:")
+
+    def clear(self, key):
+        self.backend.delete(f"limit:{key}")
+
+
+def state_backend_from_env():
+    """
+    Backend named by STATE_BACKEND_URL (sqlite:///relative/state.db,
+    sqlite:////absolute/state.db or redis://host:port/db), or None to keep
+    all state in this process
+    """
+    url = os.environ.get('STATE_BACKEND_URL')
+    if not url:
+        return None
+
+    scheme = urlparse(url).scheme
+    if scheme == 'sqlite':
+        return SQLiteBackend(sqlite_path(url))
+    if scheme in ('redis', 'rediss', 'unix'):
+        return RedisBackend(url)
+    raise ValueError(f"Unsupported STATE_BACKEND_URL scheme: {scheme}")
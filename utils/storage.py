@@ -0,0 +1,145 @@
+import os
+import time
+import uuid
+import shutil
+import threading
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+DISK_BUDGET_BYTES = int(os.environ.get('DISK_BUDGET_BYTES', 2 * 1024 * 1024 * 1024))  # 2 GB
+DISK_MIN_FREE_BYTES = int(os.environ.get('DISK_MIN_FREE_BYTES', 200 * 1024 * 1024))  # 200 MB
+DEFAULT_ESTIMATE = 30 * 1024 * 1024  # reserved when the extractor reports no size
+RESERVE_WAIT = 30  # seconds a download waits for space before giving up
+EVICT_GRACE = 120  # seconds a new file is safe from eviction, so its client can fetch it
+
+
+class StorageFullError(Exception):
+    """Raised when no space can be reserved within the disk budget"""
+
+
+def estimated_filesize(info):
+    """Expected download size from extractor info, summing separate video and audio streams"""
+    formats = info.get('requested_formats') or [info]
+    total = 0
+    for fmt in formats:
+        total += fmt.get('filesize') or fmt.get('filesize_approx') or 0
+    return total or DEFAULT_ESTIMATE
+
+
+class StorageManager:
+    """
+    Byte budget for the downloads folder.
+
+    A download reserves its estimated size before it starts. If the files
+    in the registry plus outstanding reservations would exceed
+    ``max_bytes``, or the disk would drop below ``min_free_bytes``, the
+    least recently served files are evicted first; if that's not enough
+    the reservation waits for running downloads to finish and finally
+    raises StorageFullError.
+    """
+
+    def __init__(self, max_bytes=DISK_BUDGET_BYTES, min_free_bytes=DISK_MIN_FREE_BYTES,
+                 evict_grace=EVICT_GRACE):
+        self.max_bytes = max_bytes
+        self.min_free_bytes = min_free_bytes
+        self.evict_grace = evict_grace
+        self.registry = None
+        self.reservations = {}
+        self.evicted = 0
+        self.refused = 0
+        self.condition = threading.Condition()
+
+    def track(self, registry):
+        """Enforce the budget on the files of registry"""
+        self.registry = registry
+
+    def reserve(self, nbytes, wait=RESERVE_WAIT):
+        """Reserve nbytes for a download and return the reservation id"""
+        deadline = time.time() + wait
+        with self.condition:
+            while not self._fits(nbytes):
+                self._evict(nbytes)
+                if self._fits(nbytes):
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self.refused += 1
+                    raise StorageFullError("Download storage is full")
+                self.condition.wait(remaining)
+
+            reservation = uuid.uuid4().hex
+            self.reservations[reservation] = nbytes
+            return reservation
+
+    def release(self, reservation):
+        with self.condition:
+            self.reservations.pop(reservation, None)
+            self.condition.notify_all()
+
+    @contextmanager
+    def reserved(self, nbytes, wait=RESERVE_WAIT):
+        """Hold a reservation for the duration of the with-block"""
+        reservation = self.reserve(nbytes, wait)
+        try:
+            yield
+        finally:
+            self.release(reservation)
+
+    def saturated(self, nbytes=DEFAULT_ESTIMATE):
+        """True if nbytes couldn't be reserved even after evicting every evictable file"""
+        if not self.registry:
+            return False
+        with self.condition:
+            pending = sum(self.reservations.values())
+            used = self.registry.stats()['bytes'] + pending
+            free = self._disk_free() - pending
+        # Runs on every download request: only count evictable files when close to the budget
+        if used + nbytes <= self.max_bytes and free - nbytes >= self.min_free_bytes:
+            return False
+        evictable = self.registry.evictable_bytes(self.evict_grace)
+        return used - evictable + nbytes > self.max_bytes or free + evictable - nbytes < self.min_free_bytes
+
+    def stats(self):
+        with self.condition:
+            return {
+                "max_bytes": self.max_bytes,
+                "used_bytes": self.registry.stats()['bytes'] if self.registry else 0,
+                "reserved_bytes": sum(self.reservations.values()),
+                "free_disk_bytes": self._disk_free(),
+                "evicted": self.evicted,
+                "refused": self.refused,
+            }
+
+    def _fits(self, nbytes, freed=0):
+        pending = sum(self.reservations.values())
+        used = (self.registry.stats()['bytes'] if self.registry else 0) + pending - freed
+        if used + nbytes > self.max_bytes:
+            return False
+        return self._disk_free() + freed - pending - nbytes >= self.min_free_bytes
+
+    def _evict(self, nbytes):
+        """Remove least recently served files until nbytes fit or nothing is left to evict"""
+        if not self.registry:
+            return
+        candidates = self.registry.least_recently_used(self.evict_grace)
+        # Don't throw files away if even evicting all of them wouldn't make room
+        if not self._fits(nbytes, freed=sum(entry['size'] for entry in candidates)):
+            return
+        for entry in candidates:
+            if self._fits(nbytes):
+                return
+            logger.info(f"Evicting {entry['filename']} to free disk space")
+            self.registry.remove(entry['filename'])
+            self.evicted += 1
+
+    def _disk_free(self):
+        folder = self.registry.folder if self.registry else '.'
+        try:
+            return shutil.disk_usage(folder).free
+        except OSError:
+            return self.min_free_bytes + self.max_bytes
+
+
+storage_manager = StorageManager()
@@ -0,0 +1,387 @@
+import os
+import uuid
+import time
+import logging
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from utils.downloader import build_ydl_options, progress_hook, clean_title, format_duration, handle_download_error
+from utils.cache import PERMANENT_REASONS
+from utils.circuit import CircuitBreakers
+from utils.strategy_stats import StrategyStats, url_domain
+from utils.urls import metric_platform
+from utils.proxies import get_random_proxy, record_proxy_result
+from utils.metrics import timed, STAGE_SECONDS, STRATEGY_ATTEMPTS
+from utils.file_registry import discard_partial
+from utils.storage import storage_manager, estimated_filesize, StorageFullError
+from utils.ydl_pool import ydl_pool, profile_key
+from utils.jobs import current_job_id
+from utils.throttle import upstream_throttle, current_lane, ThrottledError
+
+logger = logging.getLogger(__name__)
+
+# Fallback strategies, formerly simple_download / alternative_format_download /
+# minimal_download. The alternative format loop is a single '/' chain so yt-dlp
+# picks the first format that exists from one extraction.
+FALLBACK_STRATEGIES = [
+    {"name": "simple", "format": "best[height<=720]", "retries": 3},
+    {"name": "alt", "format": "best[ext=mp4]/worst[height>=240]/best[height<=480]/best", "retries": 2},
+    {"name": "min", "format": None, "retries": 10},
+]
+
+STRATEGY_TIMEOUT = 45  # seconds a single metadata probe may take
+RACE_DEADLINE = 120  # seconds for all probes of one request together
+MAX_PARALLEL_PROBES = 8
+QUEUED_PROBE_POLL = 0.5  # seconds between checks whether a queued probe has started
+STATS_FILE = os.environ.get('STRATEGY_STATS_FILE', os.path.join('data', 'strategy_stats.json'))
+# Sites whose strategy profiles are built ahead of the first request
+WARM_URLS = ('https://www.instagram.com/', 'https://www.facebook.com/')
+WARM_EXTRACTORS = ('Instagram', 'Facebook')
+
+probe_executor = ThreadPoolExecutor(max_workers=MAX_PARALLEL_PROBES, thread_name_prefix='strategy-probe')
+strategy_stats = StrategyStats(STATS_FILE)
+# Per (domain, strategy): skip a strategy that keeps failing for every reel
+strategy_breakers = CircuitBreakers()
+
+
+def cookie_strategy(cookies):
+    """The primary strategy: full browser headers plus a cookie pool entry (or None)"""
+    return {
+        "name": "cookies",
+        "format": "best",
+        "retries": 10,
+        "cookies_file": cookies['path'] if cookies else None,
+        "cookie_jar": cookies['jar'] if cookies else None,
+    }
+
+
+def build_strategy_options(url, strategy, filepath, timeout, progress_callback=None, proxy=None):
+    """yt-dlp options for one strategy"""
+    if 'cookies_file' in strategy:
+        # The parsed jar is attached in probe_strategy, so yt-dlp doesn't re-read the file
+        ydl_opts = build_ydl_options(url, filepath, None, progress_callback, proxy)
+        ydl_opts['outtmpl'] = filepath
+        ydl_opts['socket_timeout'] = timeout
+        return ydl_opts
+
+    ydl_opts = {
+        'outtmpl': filepath,
+        'quiet': True,
+        'retries': strategy['retries'],
+        'socket_timeout': timeout,
+        'progress_hooks': [lambda d: progress_hook(d, progress_callback)],
+    }
+    if strategy['format']:
+        ydl_opts['format'] = strategy['format']
+    if proxy:
+        ydl_opts['proxy'] = proxy
+    return ydl_opts
+
+
+def strategy_filename(strategy, file_id=None):
+    """Output file name for one strategy's download; fixed per file_id, random without one"""
+    return f"reel_{strategy['name']}_{file_id or uuid.uuid4().hex}.mp4"
+
+
+def probe_strategy(url, strategy, download_folder, timeout, progress_callback=None, file_id=None):
+    """
+    Resolve metadata and format for one strategy without downloading.
+    Returns (ydl, info, filename); the caller must hand the YoutubeDL back
+    to ydl_pool. With a file_id (the job id) the filename is the same every
+    time, so a download interrupted by a restart continues from its .part file.
+    """
+    filename = strategy_filename(strategy, file_id)
+    filepath = os.path.join(download_folder, filename)
+
+    platform = metric_platform(url)
+    proxy = get_random_proxy()
+    started = time.time()
+
+    cookie_jar = strategy.get('cookie_jar')
+    ydl = ydl_pool.acquire(
+        profile_key(strategy['name'], url, proxy, cookie_jar, timeout),
+        build_strategy_options(url, strategy, filepath, timeout, proxy=proxy),
+        cookie_jar,
+        outtmpl=filepath,
+        progress_hooks=[lambda d: progress_hook(d, progress_callback)],
+    )
+    try:
+        with timed(STAGE_SECONDS, stage='extract', domain=platform, strategy=strategy['name']):
+            info = ydl.extract_info(url, download=False)
+        if not info:
+            raise ValueError("No video info returned")
+        record_proxy_result(proxy, started)
+        STRATEGY_ATTEMPTS.inc(domain=platform, strategy=strategy['name'], outcome='success')
+        return ydl, info, filename
+    except Exception as e:
+        record_proxy_result(proxy, started, e)
+        STRATEGY_ATTEMPTS.inc(domain=platform, strategy=strategy['name'], outcome='failure')
+        ydl_pool.release(ydl)
+        raise
+
+
+def download_probed(ydl, info, filename, download_folder, strategy, platform='other'):
+    """Download the format a successful probe resolved"""
+    filepath = os.path.join(download_folder, filename)
+    proxy = ydl.params.get('proxy')
+    started = time.time()
+
+    try:
+        with timed(STAGE_SECONDS, stage='transfer', domain=platform, strategy=strategy['name']):
+            info = ydl.process_ie_result(info, download=True)
+    except Exception as e:
+        record_proxy_result(proxy, started, e)
+        discard_partial(filepath)
+        raise
+    finally:
+        ydl_pool.release(ydl)
+    record_proxy_result(proxy, started)
+
+    with timed(STAGE_SECONDS, stage='verify', domain=platform, strategy=strategy['name']):
+        file_size = os.path.getsize(filepath) if os.path.exists(filepath) else 0
+
+    if file_size > 1024:
+        return {
+            "success": True,
+            "filename": filename,
+            "filepath": filepath,
+            "file_size": file_size,
+            "title": clean_title(info.get('title', 'reel')),
+            "duration": format_duration(info.get('duration')),
+            "thumbnail": info.get('thumbnail'),
+            "quality": info.get('format_note', 'HD'),
+            "strategy": strategy['name'],
+        }
+    discard_partial(filepath)
+    return {"success": False, "error": "Downloaded file is empty or too small", "strategy": strategy['name']}
+
+
+def race_strategies(url, download_folder, strategies=None, progress_callback=None,
+                    strategy_timeout=STRATEGY_TIMEOUT, deadline=RACE_DEADLINE, hedge_delay=0):
+    """
+    Probe strategies concurrently and download once with the first that resolves.
+
+    Strategies are started in the given order. With a hedge_delay each one gets
+    that many seconds' head start before the next is started; a failure starts
+    the next one immediately. Probes that have not started when a winner is found
+    are cancelled; probes already running are abandoned, but their outcome is
+    still recorded when they finish. A probe slower than strategy_timeout counts as failed, and no
+    probe is waited on past deadline. A probe's time is counted from when a
+    probe thread picks it up, not from when it was queued, and a probe that
+    never started isn't held against its strategy. Outcomes are recorded in strategy_stats and
+    strategy_breakers; strategies whose breaker is open are skipped, unless that
+    would leave none.
+
+    Every probe, and the download after it, holds its own upstream_throttle
+    slot, so a race counts against the platform's pacing once per request it
+    sends. A probe's clock starts when it has its slot. If no probe got a slot
+    the ThrottledError is raised.
+
+    In a job, files are named after the job id so a resumed download
+    continues its .part file; once the race is over, the partial files of
+    the strategies that didn't produce the result are deleted.
+    """
+    strategies = list(strategies or FALLBACK_STRATEGIES)
+    # Probes run on other threads; name their files after this thread's job
+    file_id = current_job_id()
+    result = None
+    try:
+        result = _race_strategies(
+            url, download_folder, strategies, progress_callback, strategy_timeout, deadline, hedge_delay, file_id
+        )
+        return result
+    finally:
+        if file_id:
+            # Left behind by an earlier run of this job that used another strategy
+            kept = result.get('filename') if result and result['success'] else None
+            for strategy in strategies:
+                filename = strategy_filename(strategy, file_id)
+                if filename != kept:
+                    discard_partial(os.path.join(download_folder, filename))
+
+
+def _race_strategies(url, download_folder, strategies, progress_callback, strategy_timeout, deadline, hedge_delay,
+                     file_id):
+    domain = url_domain(url)
+    platform = metric_platform(url)
+    race_started = time.time()
+    race_deadline = race_started + deadline
+    # Probes run on other threads; queue their upstream requests in this thread's lane
+    lane = current_lane()
+
+    waiting = [strategy for strategy in strategies if strategy_breakers.allow((domain, strategy['name']))]
+    for strategy in strategies:
+        if strategy not in waiting:
+            STRATEGY_ATTEMPTS.inc(domain=platform, strategy=strategy['name'], outcome='skipped')
+    if len(waiting) < len(strategies):
+        logger.info(f"Skipping strategies with open circuit breakers: "
+                    f"{[s['name'] for s in strategies if s not in waiting]}")
+    waiting = waiting or strategies[:1]
+    pending = {}
+    next_launch = race_started
+    errors = {}
+    throttled = None
+    winner = None
+
+    try:
+        while (pending or waiting) and not winner:
+            now = time.time()
+            if now >= race_deadline:
+                logger.warning(f"Strategy race deadline reached after {round(now - race_started, 2)}s")
+                break
+
+            # Start the next strategy when its head start is over or nothing is running
+            while waiting and (now >= next_launch or not pending):
+                strategy = waiting.pop(0)
+                timing = {"started": None}
+                # A probe still queued for a slot gives up just before the race does
+                future = probe_executor.submit(
+                    timed_probe, timing, lane, race_deadline - QUEUED_PROBE_POLL,
+                    url, strategy, download_folder, strategy_timeout, progress_callback, file_id,
+                )
+                pending[future] = (strategy, timing)
+                next_launch = now + hedge_delay
+
+            # Drop probes that have exceeded their own budget
+            for future, (strategy, timing) in list(pending.items()):
+                started = timing['started']
+                if started is not None and now - started > strategy_timeout:
+                    logger.warning(f"Strategy {strategy['name']} timed out")
+                    errors[strategy['name']] = "Timed out"
+                    strategy_stats.record(domain, strategy, False, now - started)
+                    record_breaker(domain, strategy, "Timed out")
+                    future.cancel()
+                    future.add_done_callback(close_abandoned_probe)
+                    del pending[future]
+            if not pending:
+                continue
+
+            # A probe still waiting for a thread has no timeout yet; look again shortly
+            wake_at = min(
+                timing['started'] + strategy_timeout if timing['started'] is not None else now + QUEUED_PROBE_POLL
+                for _, timing in pending.values()
+            )
+            wake_at = min(wake_at, race_deadline)
+            if waiting:
+                wake_at = min(wake_at, next_launch)
+            done, _ = wait(pending, timeout=max(0, wake_at - now), return_when=FIRST_COMPLETED)
+
+            for future in done:
+                strategy, timing = pending.pop(future)
+                try:
+                    ydl, info, filename = future.result()
+                except ThrottledError as e:
+                    # Never reached the platform; not the strategy's fault
+                    throttled = e
+                    logger.info(f"Strategy {strategy['name']} got no upstream slot: {str(e)}")
+                    continue
+                except Exception as e:
+                    latency = time.time() - timing['started']
+                    errors[strategy['name']] = str(e)
+                    strategy_stats.record(domain, strategy, False, latency)
+                    record_breaker(domain, strategy, e)
+                    logger.info(f"Strategy {strategy['name']} failed: {str(e)}")
+                    continue
+
+                strategy_stats.record(domain, strategy, True, time.time() - timing['started'])
+                record_breaker(domain, strategy)
+                if winner:
+                    # Another probe finished in the same round; keep the first
+                    ydl_pool.release(ydl)
+                else:
+                    winner = (strategy, ydl, info, filename)
+    finally:
+        for future, (strategy, timing) in pending.items():
+            future.cancel()
+            future.add_done_callback(partial(record_abandoned_probe, domain, strategy, timing))
+
+    if not winner:
+        if throttled is not None and not errors:
+            raise throttled
+        return {
+            "success": False,
+            "error": "All download methods failed",
+            "solution": "The reel might be private, geo-restricted, or unavailable. Try uploading cookies for private accounts.",
+            "errors": errors,
+        }
+
+    strategy, ydl, info, filename = winner
+    logger.info(f"Strategy {strategy['name']} won after {round(time.time() - race_started, 2)}s")
+
+    try:
+        # Hold disk space for the expected size before any bytes arrive
+        with storage_manager.reserved(estimated_filesize(info)), upstream_throttle.slot(url, lane):
+            result = download_probed(ydl, info, filename, download_folder, strategy, platform)
+    except ThrottledError:
+        ydl_pool.release(ydl)
+        raise
+    except StorageFullError as e:
+        logger.warning(f"No disk space for {url}: {str(e)}")
+        ydl_pool.release(ydl)
+        return {
+            "success": False,
+            "error": "Server storage is full",
+            "solution": "Try again in a few minutes",
+            "reason": "storage_full",
+            "errors": errors,
+        }
+    except Exception as e:
+        logger.error(f"Download with strategy {strategy['name']} failed: {str(e)}")
+        errors[strategy['name']] = str(e)
+        result = {
+            "success": False,
+            "error": "All download methods failed",
+            "solution": "Try again in a moment",
+            "errors": errors,
+        }
+
+    if not result['success']:
+        strategy_stats.record(domain, strategy, False, time.time() - race_started)
+        record_breaker(domain, strategy, result['error'])
+    # Losing strategies' errors are still useful to the caller, e.g. for cookie health
+    result['errors'] = errors
+    return result
+
+
+def timed_probe(timing, lane, deadline, url, *args):
+    """
+    probe_strategy(url, *args) holding an upstream slot in lane, noting in
+    timing when it got the slot and started
+    """
+    with upstream_throttle.slot(url, lane, deadline=deadline):
+        timing['started'] = time.time()
+        return probe_strategy(url, *args)
+
+
+def record_breaker(domain, strategy, error=None):
+    """Feed a strategy outcome to its circuit breaker; failures caused by the reel itself don't count"""
+    if error is not None and handle_download_error(str(error), None)['reason'] in PERMANENT_REASONS:
+        return
+    strategy_breakers.record((domain, strategy['name']), error is None)
+
+
+def close_abandoned_probe(future):
+    """Return the YoutubeDL of a probe that finished after the race was decided"""
+    if future.cancelled() or future.exception() is not None:
+        return
+    ydl, _, _ = future.result()
+    ydl_pool.release(ydl)
+
+
+def record_abandoned_probe(domain, strategy, timing, future):
+    """Still learn from a losing probe that ran to completion, then release it"""
+    if not future.cancelled() and not isinstance(future.exception(), ThrottledError):
+        strategy_stats.record(domain, strategy, future.exception() is None, time.time() - timing['started'])
+        record_breaker(domain, strategy, future.exception())
+    close_abandoned_probe(future)
+
+
+def warm_ydl_pool():
+    """Build one YoutubeDL per strategy and site before the first request needs it"""
+    profiles = [
+        (profile_key(strategy['name'], url, None, None, STRATEGY_TIMEOUT),
+         build_strategy_options(url, strategy, 'warmup.mp4', STRATEGY_TIMEOUT))
+        for url in WARM_URLS
+        for strategy in [cookie_strategy(None)] + FALLBACK_STRATEGIES
+    ]
+    return ydl_pool.warm(profiles, WARM_EXTRACTORS)
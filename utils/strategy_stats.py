@@ -0,0 +1,131 @@
+import os
+import json
+import time
+import threading
+import logging
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+ALPHA = 0.2  # weight of the newest sample in the moving averages
+PRIOR_SUCCESS_RATE = 0.5
+PRIOR_LATENCY = 5.0  # seconds assumed for a strategy we've never seen succeed
+MIN_SUCCESS_RATE = 0.05
+SAVE_INTERVAL = 30  # seconds between writes to disk
+
+
+def url_domain(url):
+    """Registrable domain used to group stats, e.g. 'instagram.com'"""
+    try:
+        host = (urlparse(url if '://' in url else f'https://{url}').hostname or '').lower()
+    except ValueError:
+        return ''
+    for prefix in ('www.', 'm.', 'web.', 'mbasic.'):
+        if host.startswith(prefix):
+            return host[len(prefix):]
+    return host
+
+
+class StrategyStats:
+    """
+    Success rate and latency per domain x strategy x format string.
+
+    Both are exponentially weighted so the ordering follows upstream changes.
+    Stats are written to a JSON file at most every SAVE_INTERVAL seconds and
+    reloaded on start.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.stats = {}
+        self.dirty = False
+        self.last_saved = 0
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+        self.load()
+
+    @staticmethod
+    def key(domain, strategy):
+        return f"{domain}|{strategy['name']}|{strategy.get('format') or ''}"
+
+    def record(self, domain, strategy, success, latency):
+        """Record the outcome of one attempt"""
+        key = self.key(domain, strategy)
+        with self.lock:
+            entry = self.stats.setdefault(key, {
+                "attempts": 0,
+                "successes": 0,
+                "success_rate": PRIOR_SUCCESS_RATE,
+                "latency": None,
+            })
+            entry['attempts'] += 1
+            entry['success_rate'] += ALPHA * ((1.0 if success else 0.0) - entry['success_rate'])
+            if success:
+                entry['successes'] += 1
+                if entry['latency'] is None:
+                    entry['latency'] = latency
+                else:
+                    entry['latency'] += ALPHA * (latency - entry['latency'])
+            self.dirty = True
+
+        if time.time() - self.last_saved > SAVE_INTERVAL:
+            self.save()
+
+    def expected_cost(self, domain, strategy):
+        """Expected seconds until success: mean latency divided by success rate"""
+        with self.lock:
+            entry = self.stats.get(self.key(domain, strategy))
+        if not entry:
+            return PRIOR_LATENCY / PRIOR_SUCCESS_RATE
+
+        latency = entry['latency'] if entry['latency'] is not None else PRIOR_LATENCY
+        return latency / max(entry['success_rate'], MIN_SUCCESS_RATE)
+
+    def order(self, domain, strategies):
+        """Strategies sorted cheapest-expected-first; ties keep the given order"""
+        return sorted(strategies, key=lambda strategy: self.expected_cost(domain, strategy))
+
+    def hedge_delay(self, domain, strategy, minimum=1.0, maximum=10.0):
+        """
+        How long to give the favourite a head start before starting the next
+        strategy: 1.5x its usual latency, or 0 (start everything) if unknown.
+        """
+        with self.lock:
+            entry = self.stats.get(self.key(domain, strategy))
+        if not entry or entry['latency'] is None:
+            return 0
+        return min(max(entry['latency'] * 1.5, minimum), maximum)
+
+    def snapshot(self):
+        with self.lock:
+            return {key: dict(entry) for key, entry in self.stats.items()}
+
+    def load(self):
+        try:
+            if os.path.exists(self.path):
+                with open(self.path) as f:
+                    self.stats = json.load(f)
+                logger.info(f"Loaded strategy stats for {len(self.stats)} strategies")
+        except Exception as e:
+            logger.error(f"Could not load strategy stats: {str(e)}")
+
+    def save(self):
+        """Write stats atomically if anything changed"""
+        with self.lock:
+            if not self.dirty:
+                return
+            data = json.dumps(self.stats)
+            self.dirty = False
+            self.last_saved = time.time()
+
+        try:
+            with self.save_lock:
+                directory = os.path.dirname(self.path)
+                if directory and not os.path.exists(directory):
+                    os.makedirs(directory)
+                tmp_path = f"{self.path}.tmp"
+                with open(tmp_path, 'w') as f:
+                    f.write(data)
+                os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.error(f"Could not save strategy stats: {str(e)}")
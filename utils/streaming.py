@@ -0,0 +1,53 @@
+import requests
+import logging
+from requests.adapters import HTTPAdapter
+
+from utils.metrics import BYTES_SERVED
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 30
+
+# Upstream headers passed through to the client
+RELAYED_HEADERS = ('Content-Type', 'Content-Length', 'Content-Range', 'Accept-Ranges', 'Last-Modified', 'ETag')
+
+# One pooled session for all CDN traffic, so keep-alive connections are reused
+session = requests.Session()
+session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=32))
+session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=32))
+
+
+def open_upstream(media_url, http_headers=None, range_header=None):
+    """Open a streaming GET to the media URL, forwarding the client's Range header"""
+    headers = dict(http_headers or {})
+    # Ask for the raw bytes so Content-Length and ranges line up with what we relay
+    headers['Accept-Encoding'] = 'identity'
+    if range_header:
+        headers['Range'] = range_header
+
+    return session.get(
+        media_url,
+        headers=headers,
+        stream=True,
+        timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+    )
+
+
+def relay_headers(upstream):
+    """Pick the upstream response headers worth relaying"""
+    return {name: upstream.headers[name] for name in RELAYED_HEADERS if name in upstream.headers}
+
+
+def iter_upstream(upstream, chunk_size=CHUNK_SIZE):
+    """Yield the upstream body in fixed-size chunks and release the connection"""
+    try:
+        for chunk in upstream.iter_content(chunk_size=chunk_size):
+            if chunk:
+                BYTES_SERVED.inc(len(chunk), endpoint='stream')
+                yield chunk
+    except requests.RequestException as e:
+        logger.warning(f"Upstream stream interrupted: {str(e)}")
+    finally:
+        upstream.close()
@@ -0,0 +1,256 @@
+import os
+import re
+import time
+import heapq
+import itertools
+import threading
+import logging
+from contextlib import contextmanager
+
+from utils.urls import url_platform
+from utils.metrics import counter, gauge, histogram
+
+logger = logging.getLogger(__name__)
+
+UPSTREAM_RATE = float(os.environ.get('UPSTREAM_RATE', 2))  # new upstream downloads per second per platform
+UPSTREAM_BURST = int(os.environ.get('UPSTREAM_BURST', 5))
+UPSTREAM_CONCURRENCY = int(os.environ.get('UPSTREAM_CONCURRENCY', 4))  # running at once per platform
+UPSTREAM_WAIT = int(os.environ.get('UPSTREAM_WAIT', 60))  # seconds an interactive request waits for a slot
+BACKGROUND_WAIT = 600
+BACKOFF_BASE = 30  # seconds; doubles on every rate limit in a row
+BACKOFF_MAX = 600
+
+# Lanes, highest priority first
+LANE_INTERACTIVE = 0
+LANE_BACKGROUND = 1
+LANE_NAMES = {LANE_INTERACTIVE: 'interactive', LANE_BACKGROUND: 'background'}
+
+# Error fragments that mean the platform is throttling us. A bare '429' is
+# not one of them: it turns up inside numeric media ids.
+RATE_LIMIT_HINTS = ('rate limit', 'rate-limit', 'too many requests', 'please wait a few minutes')
+RATE_LIMIT_STATUS_RE = re.compile(r'\bHTTP Error 429\b|\b429 Too Many Requests\b', re.I)
+
+THROTTLE_WAIT_SECONDS = histogram(
+    'reels_upstream_wait_seconds',
+    'Time spent waiting for an upstream slot',
+    ('platform', 'lane'),
+)
+THROTTLE_REJECTED = counter(
+    'reels_upstream_rejected_total',
+    'Requests that gave up waiting for an upstream slot',
+    ('platform', 'lane'),
+)
+UPSTREAM_BACKOFFS = counter('reels_upstream_backoffs_total', 'Rate-limit backoffs started', ('platform',))
+
+# The lane of the work running on the current thread
+_lane = threading.local()
+
+
+def is_rate_limited(error_msg):
+    """True if an error message says the platform is rate limiting us"""
+    error_lower = str(error_msg).lower()
+    return any(hint in error_lower for hint in RATE_LIMIT_HINTS) or bool(RATE_LIMIT_STATUS_RE.search(error_lower))
+
+
+def platform_for(url):
+    """Platform whose upstream budget url counts against, or None"""
+    return url_platform(url)
+
+
+def current_lane():
+    return getattr(_lane, 'value', LANE_INTERACTIVE)
+
+
+def run_in_lane(lane, func, *args, **kwargs):
+    """Call func with upstream requests it makes queued in lane"""
+    previous = current_lane()
+    _lane.value = lane
+    try:
+        return func(*args, **kwargs)
+    finally:
+        _lane.value = previous
+
+
+class ThrottledError(Exception):
+    """Raised when no upstream slot came free in time"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class UpstreamThrottle:
+    """
+    Outbound scheduler protecting Instagram/Facebook from bursts.
+
+    Each platform has a token bucket (``rate`` new downloads per second,
+    up to ``burst`` at once) and a cap of ``concurrency`` downloads in
+    flight. Waiters are served interactive lane first, then background
+    (batches), first come first served within a lane; background work may
+    hold at most half the slots so interactive requests never queue behind
+    a whole batch. A rate-limit error pauses the platform for an
+    exponentially growing backoff; a success resets it.
+    """
+
+    def __init__(self, rate=UPSTREAM_RATE, burst=UPSTREAM_BURST, concurrency=UPSTREAM_CONCURRENCY):
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self.background_limit = max(1, concurrency // 2)
+        self.platforms = {}
+        self.sequence = itertools.count()
+        self.cond = threading.Condition()
+
+    def _platform(self, name):
+        state = self.platforms.get(name)
+        if state is None:
+            state = self.platforms[name] = {
+                "tokens": float(self.burst),
+                "refilled_at": time.time(),
+                "active": {LANE_INTERACTIVE: 0, LANE_BACKGROUND: 0},
+                "waiters": [],
+                "backoff_until": 0,
+                "backoff_level": 0,
+                "rejected": 0,
+            }
+        return state
+
+    def _refill(self, state, now):
+        state['tokens'] = min(self.burst, state['tokens'] + (now - state['refilled_at']) * self.rate)
+        state['refilled_at'] = now
+
+    def _can_start(self, state, ticket, now):
+        lane = ticket[0]
+        active = state['active']
+        return (
+            state['waiters'][0] == ticket
+            and now >= state['backoff_until']
+            and state['tokens'] >= 1
+            and active[LANE_INTERACTIVE] + active[LANE_BACKGROUND] < self.concurrency
+            and (lane == LANE_INTERACTIVE or active[LANE_BACKGROUND] < self.background_limit)
+        )
+
+    def acquire(self, platform, lane=LANE_INTERACTIVE, timeout=None, deadline=None):
+        """
+        Wait for a slot on platform; raises ThrottledError after timeout
+        seconds, or at deadline (a time.time() value) if that comes first
+        """
+        if timeout is None:
+            timeout = UPSTREAM_WAIT if lane == LANE_INTERACTIVE else BACKGROUND_WAIT
+        if deadline is not None:
+            timeout = max(min(timeout, deadline - time.time()), 0)
+        deadline = time.time() + timeout
+
+        with self.cond:
+            state = self._platform(platform)
+            ticket = (lane, next(self.sequence))
+            heapq.heappush(state['waiters'], ticket)
+            try:
+                while True:
+                    now = time.time()
+                    self._refill(state, now)
+                    if self._can_start(state, ticket, now):
+                        heapq.heappop(state['waiters'])
+                        state['tokens'] -= 1
+                        state['active'][lane] += 1
+                        return
+
+                    if now >= deadline:
+                        state['rejected'] += 1
+                        raise ThrottledError(
+                            f"No {platform} upstream slot within {round(timeout)}s", self._retry_after(state, now)
+                        )
+
+                    # Sleep until a token or the end of the backoff, unless a release wakes us first
+                    wake_at = deadline
+                    if state['backoff_until'] > now:
+                        wake_at = min(wake_at, state['backoff_until'])
+                    elif state['tokens'] < 1 and self.rate:
+                        wake_at = min(wake_at, now + (1 - state['tokens']) / self.rate)
+                    self.cond.wait(max(wake_at - now, 0.01))
+            finally:
+                if ticket in state['waiters']:
+                    state['waiters'].remove(ticket)
+                    heapq.heapify(state['waiters'])
+                # The next waiter may be able to go now
+                self.cond.notify_all()
+
+    def _retry_after(self, state, now):
+        return int(max(state['backoff_until'] - now, 1 / self.rate if self.rate else 1)) + 1
+
+    def retry_after(self, url):
+        """Seconds a client should wait before trying url's platform again"""
+        platform = platform_for(url) or 'other'
+        with self.cond:
+            return self._retry_after(self._platform(platform), time.time())
+
+    def release(self, platform, lane=LANE_INTERACTIVE):
+        with self.cond:
+            self.platforms[platform]['active'][lane] -= 1
+            self.cond.notify_all()
+
+    @contextmanager
+    def slot(self, url, lane=None, deadline=None):
+        """Hold an upstream slot for url's platform (in the current thread's lane) for the with-block"""
+        platform = platform_for(url)
+        if platform is None:
+            yield
+            return
+
+        lane = current_lane() if lane is None else lane
+        started = time.time()
+        try:
+            self.acquire(platform, lane, deadline=deadline)
+        except ThrottledError:
+            THROTTLE_REJECTED.inc(platform=platform, lane=LANE_NAMES[lane])
+            raise
+        finally:
+            THROTTLE_WAIT_SECONDS.observe(time.time() - started, platform=platform, lane=LANE_NAMES[lane])
+        try:
+            yield
+        finally:
+            self.release(platform, lane)
+
+    def report(self, url, error_msgs=()):
+        """
+        Feed back the outcome of an upstream download: back off when any
+        error is a rate limit, and end the backoff streak on success
+        """
+        platform = platform_for(url)
+        if platform is None:
+            return
+
+        with self.cond:
+            state = self._platform(platform)
+            if not any(is_rate_limited(error) for error in error_msgs if error):
+                state['backoff_level'] = 0
+                return
+
+            delay = min(BACKOFF_BASE * 2 ** state['backoff_level'], BACKOFF_MAX)
+            state['backoff_level'] += 1
+            state['backoff_until'] = max(state['backoff_until'], time.time() + delay)
+            state['tokens'] = 0
+        UPSTREAM_BACKOFFS.inc(platform=platform)
+        logger.warning(f"{platform} is rate limiting us; pausing new downloads for {delay}s")
+
+    def stats(self):
+        now = time.time()
+        with self.cond:
+            result = {}
+            for name, state in self.platforms.items():
+                self._refill(state, now)
+                result[name] = {
+                    "tokens": round(state['tokens'], 2),
+                    "active": {LANE_NAMES[lane]: count for lane, count in state['active'].items()},
+                    "waiting": len(state['waiters']),
+                    "backoff_seconds": max(round(state['backoff_until'] - now), 0),
+                    "rejected": state['rejected'],
+                }
+            return result
+
+
+upstream_throttle = UpstreamThrottle()
+
+gauge('reels_upstream_waiting', 'Requests waiting for an upstream slot', ('platform',), callback=lambda: [
+    ({"platform": name}, stats['waiting']) for name, stats in upstream_throttle.stats().items()
+])
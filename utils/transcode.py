@@ -0,0 +1,105 @@
+import os
+import shutil
+import logging
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.file_registry import discard_partial
+from utils.storage import storage_manager, StorageFullError
+from utils.metrics import timed, STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+FFMPEG = os.environ.get('FFMPEG_PATH') or shutil.which('ffmpeg')
+TRANSCODE_WORKERS = int(os.environ.get('TRANSCODE_WORKERS', 2))  # ffmpeg processes running at once
+TRANSCODE_TIMEOUT = int(os.environ.get('TRANSCODE_TIMEOUT', 300))
+
+# ffmpeg output options and extension per preset. Every MP4 gets its index
+# moved to the front so players can start before the whole file arrives.
+PRESETS = {
+    '480p': {
+        "ext": "mp4",
+        "args": [
+            '-vf', 'scale=-2:min(480\\,ih)', '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '28',
+            '-c:a', 'aac', '-b:a', '96k', '-movflags', '+faststart',
+        ],
+    },
+    '720p': {
+        "ext": "mp4",
+        "args": [
+            '-vf', 'scale=-2:min(720\\,ih)', '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '24',
+            '-c:a', 'aac', '-b:a', '128k', '-movflags', '+faststart',
+        ],
+    },
+    'audio': {
+        "ext": "m4a",
+        "args": ['-vn', '-c:a', 'aac', '-b:a', '128k', '-movflags', '+faststart'],
+    },
+    'faststart': {
+        "ext": "mp4",
+        "args": ['-c', 'copy', '-movflags', '+faststart'],
+    },
+}
+
+# ffmpeg runs as a child process; the pool only bounds how many at once
+transcode_executor = ThreadPoolExecutor(max_workers=TRANSCODE_WORKERS, thread_name_prefix='transcode')
+
+
+def transcode_available():
+    return FFMPEG is not None
+
+
+def variant_key(cache_key, preset):
+    """Result cache key of a preset's output for a reel"""
+    return f"{cache_key}@{preset}"
+
+
+def variant_filename(filename, preset):
+    stem = os.path.splitext(filename)[0]
+    return f"{stem}_{preset}.{PRESETS[preset]['ext']}"
+
+
+def transcode(source, preset, download_folder):
+    """
+    Produce a preset's variant of a downloaded reel (a download result or
+    cached metadata dict). Returns a result dict like a download's.
+    """
+    if not transcode_available():
+        return {"success": False, "error": "Transcoding is not available on this server"}
+
+    filename = variant_filename(source['filename'], preset)
+    filepath = os.path.join(download_folder, filename)
+    command = [
+        FFMPEG, '-hide_banner', '-loglevel', 'error', '-y', '-nostdin',
+        '-i', os.path.join(download_folder, source['filename']),
+        *PRESETS[preset]['args'],
+        filepath,
+    ]
+
+    try:
+        # A variant is never bigger than its source by much
+        with storage_manager.reserved(source.get('file_size') or 0):
+            with timed(STAGE_SECONDS, stage='transcode', domain='', strategy=preset):
+                completed = transcode_executor.submit(
+                    subprocess.run, command, capture_output=True, timeout=TRANSCODE_TIMEOUT
+                ).result()
+    except StorageFullError:
+        return {"success": False, "error": "Server storage is full", "reason": "storage_full"}
+    except subprocess.TimeoutExpired:
+        logger.error(f"Transcode {preset} of {source['filename']} timed out")
+        discard_partial(filepath)
+        return {"success": False, "error": "Transcoding timed out", "solution": "Try the original file"}
+
+    if completed.returncode != 0 or not os.path.exists(filepath):
+        logger.error(f"Transcode {preset} of {source['filename']} failed: {completed.stderr.decode(errors='replace')[-500:]}")
+        discard_partial(filepath)
+        return {"success": False, "error": "Transcoding failed", "solution": "Try the original file"}
+
+    result = {field: source[field] for field in ('title', 'duration', 'thumbnail') if field in source}
+    result.update({
+        "success": True,
+        "filename": filename,
+        "file_size": os.path.getsize(filepath),
+        "quality": preset,
+    })
+    return result
@@ -0,0 +1,255 @@
+import re
+import time
+import logging
+from collections import namedtuple
+from functools import lru_cache
+from urllib.parse import urlparse, parse_qs, urljoin
+
+import requests
+
+from utils.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+MAX_URL_LENGTH = 2048
+SHORT_LINK_TTL = 24 * 3600  # seconds a resolved short link is remembered
+SHORT_LINK_FAILURE_TTL = 300  # and one that couldn't be resolved
+SHORT_LINK_CACHE_SIZE = 4096
+SHORT_LINK_TIMEOUT = 5
+SHORT_LINK_MAX_REDIRECTS = 5
+
+# Hosts per platform; subdomains (www., m., web.) count as the platform too
+PLATFORM_HOSTS = {
+    'instagram': ('instagram.com', 'instagr.am'),
+    'facebook': ('facebook.com', 'fb.com', 'fb.watch'),
+}
+
+# Path patterns that carry a stable media id. Fixed segments match in any
+# case; ids keep theirs. /reels/audio/<id> is a page of reels, not one.
+INSTAGRAM_MEDIA_RE = re.compile(r'^/(?:[\w.]+/)?(?:reel|reels|p|tv)/(?!audio(?:/|$))([\w-]+)', re.I)
+INSTAGRAM_STORY_RE = re.compile(r'^/stories/[\w.]+/(\d+)', re.I)
+FACEBOOK_MEDIA_RES = [
+    re.compile(r'^/reel/(\d+)', re.I),
+    re.compile(r'^/(?:[\w.]+/)?videos/(?:[\w.-]+/)?(\d+)', re.I),
+]
+FACEBOOK_VIDEO_ID_RE = re.compile(r'^\d+$')
+
+# Share links only say which reel they mean after a redirect
+SHORT_LINK_RES = {
+    'instagram': re.compile(r'^/share/(?:reel/|p/)?([\w-]+)', re.I),
+    'facebook': re.compile(r'^/share/[rv]/([\w-]+)', re.I),
+}
+FB_WATCH_RE = re.compile(r'^/([\w-]+)')
+
+# Whitespace or control characters never belong in a URL we pass on
+INVALID_CHARS_RE = re.compile(r'[\s\x00-\x1f\x7f]')
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36'
+
+
+class ParsedUrl(namedtuple('ParsedUrl', 'platform media_id short_link url')):
+    """
+    A supported reel URL: media_id is set when the URL names the reel,
+    short_link (e.g. 'fbwatch:abc') when only a redirect says which it is
+    """
+
+    @property
+    def key(self):
+        """Stable 'platform:id' key, or the short link's own key"""
+        return self.short_link or f"{self.platform}:{self.media_id}"
+
+
+def _split(url):
+    """urlparse() result for a well-formed http(s) URL, or None"""
+    if not isinstance(url, str):
+        return None
+    url = url.strip()
+    if not url or len(url) > MAX_URL_LENGTH or INVALID_CHARS_RE.search(url):
+        return None
+    try:
+        parsed = urlparse(url if '://' in url else f'https://{url}')
+        parsed.port  # raises on a malformed port
+    except ValueError:
+        return None
+    # user@host URLs are a classic way to dress one site up as another
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname or parsed.username is not None:
+        return None
+    # urlparse lowercases the scheme but not the host
+    return parsed._replace(netloc=parsed.netloc.lower())
+
+
+def _host_platform(host):
+    for platform, hosts in PLATFORM_HOSTS.items():
+        if any(host == domain or host.endswith('.' + domain) for domain in hosts):
+            return platform
+    return None
+
+
+@lru_cache(maxsize=4096)
+def url_platform(url):
+    """'instagram', 'facebook' or None, by the URL's host"""
+    parsed = _split(url)
+    return _host_platform(parsed.hostname) if parsed else None
+
+
+@lru_cache(maxsize=4096)
+def parse_url(url):
+    """
+    ParsedUrl for an Instagram/Facebook URL that points at a single reel,
+    post, video or story (directly or via a share link), or None for
+    anything else. No network access.
+    """
+    parsed = _split(url)
+    if not parsed:
+        return None
+    host = parsed.hostname
+    platform = _host_platform(host)
+    if platform is None:
+        return None
+    path = parsed.path
+    normalized = parsed.geturl()
+
+    if host == 'fb.watch' or host.endswith('.fb.watch'):
+        match = FB_WATCH_RE.match(path)
+        return ParsedUrl(platform, None, f"fbwatch:{match.group(1)}", normalized) if match else None
+
+    match = SHORT_LINK_RES[platform].match(path)
+    if match:
+        return ParsedUrl(platform, None, f"{platform}-share:{match.group(1)}", normalized)
+
+    if platform == 'instagram':
+        match = INSTAGRAM_MEDIA_RE.match(path)
+        if match:
+            return ParsedUrl(platform, match.group(1), None, normalized)
+        match = INSTAGRAM_STORY_RE.match(path)
+        if match:
+            return ParsedUrl(platform, f"story-{match.group(1)}", None, normalized)
+        return None
+
+    video_id = parse_qs(parsed.query).get('v', [None])[0]
+    if video_id and FACEBOOK_VIDEO_ID_RE.match(video_id):
+        return ParsedUrl(platform, video_id, None, normalized)
+    for pattern in FACEBOOK_MEDIA_RES:
+        match = pattern.match(path)
+        if match:
+            return ParsedUrl(platform, match.group(1), None, normalized)
+    return None
+
+
+def metric_platform(url):
+    """Label value for metrics: 'instagram', 'facebook' or 'other', never the raw host"""
+    return url_platform(url) or 'other'
+
+
+def is_supported_url(url):
+    return parse_url(url) is not None
+
+
+def canonical_media_id(url):
+    """
+    Reduce an Instagram/Facebook/fb.watch URL to a stable 'platform:id' key
+    without following short links. Returns None when the URL doesn't
+    identify a single reel.
+    """
+    parsed = parse_url(url)
+    return parsed.key if parsed else None
+
+
+class ShortLinkResolver:
+    """
+    Follows share and fb.watch links to the reel they point at, remembering
+    the answer for ``ttl`` seconds (``failure_ttl`` when there wasn't one).
+    Only the redirect headers are fetched, never the page, through the
+    upstream throttle and the proxy pool like any other upstream request.
+    """
+
+    def __init__(self, ttl=SHORT_LINK_TTL, failure_ttl=SHORT_LINK_FAILURE_TTL, max_entries=SHORT_LINK_CACHE_SIZE):
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl
+        self.entries = TTLCache(max_entries)
+
+    def cached(self, short_link):
+        """(found, ParsedUrl or None) from the cache alone"""
+        return self.entries.lookup(short_link)
+
+    def resolve(self, parsed):
+        """ParsedUrl of the reel a short link leads to, or None"""
+        from utils.throttle import ThrottledError
+
+        found, target = self.cached(parsed.short_link)
+        self.entries.count(found)
+        if found:
+            return target
+
+        try:
+            target = self._follow(parsed.url)
+        except ThrottledError as e:
+            # Not an answer about the link; ask again next time
+            logger.info(f"Short link {parsed.url} not resolved: {str(e)}")
+            return None
+        self.entries.put(parsed.short_link, target, time.time() + (self.ttl if target else self.failure_ttl))
+        return target
+
+    @staticmethod
+    def _follow(url):
+        from utils.throttle import upstream_throttle, ThrottledError
+        from utils.proxies import get_random_proxy, record_proxy_result
+
+        for _ in range(SHORT_LINK_MAX_REDIRECTS):
+            proxy = get_random_proxy()
+            started = time.time()
+            try:
+                with upstream_throttle.slot(url):
+                    response = requests.head(
+                        url, allow_redirects=False, timeout=SHORT_LINK_TIMEOUT, headers={'User-Agent': USER_AGENT},
+                        proxies={'http': proxy, 'https': proxy} if proxy else None,
+                    )
+            except requests.RequestException as e:
+                record_proxy_result(proxy, started, str(e))
+                logger.warning(f"Could not resolve short link {url}: {str(e)}")
+                return None
+            record_proxy_result(proxy, started)
+            if response.status_code == 429:
+                upstream_throttle.report(url, ['429 Too Many Requests'])
+                retry_after = response.headers.get('Retry-After', '')
+                raise ThrottledError(
+                    f"Rate limited resolving {url}",
+                    int(retry_after) if retry_after.isdigit() else upstream_throttle.retry_after(url),
+                )
+
+            location = response.headers.get('Location')
+            if not response.is_redirect or not location:
+                return None
+            url = urljoin(url, location)
+            target = parse_url(url)
+            if target and target.media_id:
+                return target
+            if url_platform(url) is None:
+                # Left the platform; the reel isn't coming
+                return None
+        return None
+
+    def stats(self):
+        return self.entries.stats()
+
+
+short_links = ShortLinkResolver()
+
+
+def media_key(url, resolve=True):
+    """
+    Stable cache/coalescing key for a supported URL, or None. Short links are
+    keyed by the reel they lead to once that's known; with resolve=False only
+    an earlier lookup is used, so nothing goes over the network.
+    """
+    parsed = parse_url(url)
+    if parsed is None:
+        return None
+    if parsed.short_link:
+        if resolve:
+            target = short_links.resolve(parsed)
+        else:
+            target = short_links.cached(parsed.short_link)[1]
+        if target:
+            return target.key
+    return parsed.key
@@ -0,0 +1,183 @@
+import os
+import time
+import threading
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from utils.metrics import counter, gauge, histogram, timed
+from utils.strategy_stats import url_domain
+
+logger = logging.getLogger(__name__)
+
+YDL_POOL_MAX_IDLE = int(os.environ.get('YDL_POOL_MAX_IDLE', 4))  # idle instances kept per profile
+YDL_POOL_MAX_PROFILES = 64
+YDL_POOL_IDLE_TIMEOUT = 600  # seconds; idle instances older than this are closed, not reused
+
+YDL_CONSTRUCT_SECONDS = histogram(
+    'reels_ydl_construct_seconds',
+    'Time to construct a YoutubeDL instance',
+    ('profile',),
+)
+YDL_CHECKOUTS = counter('reels_ydl_pool_checkouts_total', 'YoutubeDL pool checkouts', ('profile', 'result'))
+YDL_BOOT_SECONDS = gauge('reels_ydl_boot_seconds', 'Time spent pre-warming the YoutubeDL pool at boot')
+
+
+def profile_key(kind, url, proxy=None, cookie_jar=None, *extra):
+    """
+    Pool key: instances are only shared between requests with the same
+    options. The cookie jar is keyed by identity because a pooled instance
+    keeps the jar it was built with; a reloaded jar gets fresh instances.
+    """
+    return (kind, url_domain(url), proxy, id(cookie_jar) if cookie_jar is not None else None) + extra
+
+
+class YdlPool:
+    """
+    Reusable YoutubeDL instances per option profile.
+
+    Building a YoutubeDL loads every extractor and, on first request, a new
+    HTTP request director; reusing one keeps both, including keep-alive
+    connections to the CDN. An instance is used by one request at a time:
+    acquire() hands it out with that request's output template and progress
+    hooks, release() puts it back. Per profile at most ``max_idle`` instances
+    are kept, and at most ``max_profiles`` profiles, least recently used out.
+    """
+
+    def __init__(self, max_idle=YDL_POOL_MAX_IDLE, max_profiles=YDL_POOL_MAX_PROFILES,
+                 idle_timeout=YDL_POOL_IDLE_TIMEOUT):
+        self.max_idle = max_idle
+        self.max_profiles = max_profiles
+        self.idle_timeout = idle_timeout
+        self.idle = OrderedDict()
+        self.leased = {}
+        self.created = 0
+        self.reused = 0
+        self.lock = threading.Lock()
+
+    def acquire(self, key, params, cookie_jar=None, outtmpl=None, progress_hooks=()):
+        """Check out an instance for key, building one from params if none is idle"""
+        ydl = None
+        stale = []
+        now = time.time()
+        with self.lock:
+            instances = self.idle.get(key)
+            while instances:
+                candidate, released_at = instances.pop()
+                if now - released_at > self.idle_timeout:
+                    stale.append(candidate)
+                    continue
+                ydl = candidate
+                break
+            if instances is not None:
+                self.idle.move_to_end(key)
+        self._close(stale)
+
+        if ydl is None:
+            ydl = self._construct(key, params, cookie_jar)
+            YDL_CHECKOUTS.inc(profile=key[0], result='miss')
+        else:
+            YDL_CHECKOUTS.inc(profile=key[0], result='hit')
+            with self.lock:
+                self.reused += 1
+
+        self._prepare(ydl, outtmpl, progress_hooks)
+        with self.lock:
+            self.leased[id(ydl)] = key
+        return ydl
+
+    def release(self, ydl, reusable=True):
+        """Return an instance to the pool, or close it if it can't be reused"""
+        with self.lock:
+            key = self.leased.pop(id(ydl), None)
+        if key is None or not reusable:
+            self._close([ydl])
+            return
+
+        # Don't keep references to the finished request alive
+        ydl._progress_hooks = []
+        excess = []
+        with self.lock:
+            instances = self.idle.setdefault(key, [])
+            instances.append((ydl, time.time()))
+            self.idle.move_to_end(key)
+            while len(instances) > self.max_idle:
+                excess.append(instances.pop(0)[0])
+            while len(self.idle) > self.max_profiles:
+                _, evicted = self.idle.popitem(last=False)
+                excess.extend(instance for instance, _ in evicted)
+        self._close(excess)
+
+    @contextmanager
+    def borrow(self, key, params, cookie_jar=None, outtmpl=None, progress_hooks=()):
+        ydl = self.acquire(key, params, cookie_jar, outtmpl, progress_hooks)
+        try:
+            yield ydl
+        finally:
+            self.release(ydl)
+
+    def warm(self, profiles, extractors=()):
+        """
+        Build one instance per (key, params) profile ahead of the first
+        request, with the named extractors (e.g. 'Instagram') loaded and set up
+        """
+        started = time.time()
+        for key, params in profiles:
+            try:
+                ydl = self.acquire(key, params)
+                try:
+                    for ie_key in extractors:
+                        ydl.get_info_extractor(ie_key).initialize()
+                finally:
+                    self.release(ydl)
+            except Exception as e:
+                logger.warning(f"Could not pre-warm yt-dlp profile {key[0]}: {str(e)}")
+        elapsed = time.time() - started
+        YDL_BOOT_SECONDS.set(elapsed)
+        logger.info(f"Pre-warmed {len(profiles)} yt-dlp profiles in {round(elapsed, 2)}s")
+        return elapsed
+
+    def stats(self):
+        with self.lock:
+            return {
+                "profiles": len(self.idle),
+                "idle": sum(len(instances) for instances in self.idle.values()),
+                "leased": len(self.leased),
+                "created": self.created,
+                "reused": self.reused,
+            }
+
+    def _construct(self, key, params, cookie_jar):
+        import yt_dlp
+
+        # Hooks belong to a request and are attached on every checkout
+        params = {name: value for name, value in params.items() if name != 'progress_hooks'}
+        with timed(YDL_CONSTRUCT_SECONDS, profile=key[0]):
+            ydl = yt_dlp.YoutubeDL(params)
+        if cookie_jar is not None:
+            ydl.cookiejar = cookie_jar
+        with self.lock:
+            self.created += 1
+        return ydl
+
+    @staticmethod
+    def _prepare(ydl, outtmpl, progress_hooks):
+        """Point a checked-out instance at this request's output file and hooks"""
+        if outtmpl is not None:
+            if isinstance(ydl.params.get('outtmpl'), dict):
+                ydl.params['outtmpl']['default'] = outtmpl
+            else:
+                ydl.params['outtmpl'] = outtmpl
+        ydl._progress_hooks = list(progress_hooks)
+        ydl._download_retcode = 0
+
+    @staticmethod
+    def _close(instances):
+        for ydl in instances:
+            try:
+                ydl.close()
+            except Exception as e:
+                logger.warning(f"Error closing YoutubeDL: {str(e)}")
+
+
+ydl_pool = YdlPool()